@@ -1,7 +1,10 @@
 import sys
+import multiprocessing
 from array import array
 from src.mmdata import MMData
+import src.mmdata
 from src import emulaunch
+from src import batch
 import os
 
 mmageditpath = os.path.dirname(os.path.realpath(__file__))
@@ -40,7 +43,13 @@ def usage():
     print("-p: export to ips patch")
     print("-b: export to bps patch")
     print("--export-images: creates image sheet for levels")
+    print("--batch manifest.json: builds each hack listed in the manifest against the base rom (see src/batch.py)")
+    print("--serve: runs a local build server for the base rom (see src/serve.py)")
+    print("--port n: port for --serve (default 8037)")
+    print("--jobs n: number of processes used by --export-images, --batch, and --serve (default 1)")
     print("--set-chr: sets chr rom (graphics data) to the data in the given image file.")
+    print("--chr-mode m: how --set-chr converts pixels: auto (default), index, nearest, or brightness")
+    print("--chr-rect x,y,w,h: --set-chr only sets the tiles in this rectangle of the sheet (in tiles)")
     print("--zoom n: starts editor at zoom level n (n can be 0, 1, or 2)")
     print("")
     print("debug options:")
@@ -48,6 +57,7 @@ def usage():
     print("--help: show this message")
     print("--deps: check dependencies")
     print("--brx: breakpoint on byte edit")
+    print("--no-decode-cache: always decode the ROM, rather than loading it from the cache in " + src.mmdata.default_decode_cache_dir)
     print("--json: serialize data to json")
     print("--select .field[a].field2[b:c]: (etc) select elements of json out")
     print("--apply {...}: apply json to data")
@@ -90,12 +100,18 @@ def main():
     outpatch=""
     outbps=""
     chrin=""
+    chrmode="auto"
+    chrrect=None
     gui = True
     zoom_idx=0
     expimage = False
+    jobs = 1
     dojson = "--json" in sys.argv
     jsonpath = ""
     jsonapply = None
+    batchfile = ""
+    doserve = "--serve" in sys.argv[2:]
+    port = None
     startlevel = 0
     startplayers = 1
     starthard = 0
@@ -111,9 +127,21 @@ def main():
     if "--zoom" in sys.argv[2:-1]:
         zoom_idx = int(sys.argv[sys.argv.index("--zoom") + 1])
 
+    if "--jobs" in sys.argv[2:-1]:
+        jobs = int(sys.argv[sys.argv.index("--jobs") + 1])
+
     if "--set-chr" in sys.argv[2:-1]:
         chrin = sys.argv[sys.argv.index("--set-chr") + 1]
 
+    if "--chr-mode" in sys.argv[2:-1]:
+        chrmode = sys.argv[sys.argv.index("--chr-mode") + 1]
+
+    if "--chr-rect" in sys.argv[2:-1]:
+        chrrect = tuple(int(v) for v in sys.argv[sys.argv.index("--chr-rect") + 1].split(","))
+        if len(chrrect) != 4:
+            print("Error: --chr-rect must be given as x,y,w,h.")
+            sys.exit(1)
+
     if "-o" in sys.argv[2:-1]:
         gui = False
         outfile = sys.argv[sys.argv.index("-o") + 1]
@@ -143,9 +171,22 @@ def main():
         gui = False
         expimage = True
 
+    if "--batch" in sys.argv[2:-1]:
+        gui = False
+        batchfile = sys.argv[sys.argv.index("--batch") + 1]
+
+    if "--port" in sys.argv[2:-1]:
+        port = int(sys.argv[sys.argv.index("--port") + 1])
+
+    if doserve:
+        gui = False
+
     if "--brx" in sys.argv[2:]:
         src.mmdata.breakpoint_on_byte_edit = True
 
+    if "--no-decode-cache" in sys.argv[2:]:
+        src.mmdata.decode_cache_dir = None
+
     if "--apply" in sys.argv[2:-1]:
         jsonapply = sys.argv[sys.argv.index("--apply") + 1]
         
@@ -234,6 +275,14 @@ def main():
             print("An error occurred while reading the rom.")
             sys.exit()
 
+        if batchfile != "":
+            sys.exit(0 if batch.run_batch(mmdata, batchfile, jobs) else 1)
+
+        if doserve:
+            # imported here, so that the server is only loaded when it is used.
+            from src import serve
+            sys.exit(0 if serve.serve(mmdata, port, jobs) else 1)
+
         result = True
 
         if infile != "":
@@ -245,7 +294,9 @@ def main():
             if not img_available:
                 print("--set-chr requires PIL (Pillow), which is not installed. (python3 -m pip install Pillow)")
             else:
-                src.mmimage.set_chr_rom_from_image_path(mmdata, chrin)
+                if not src.mmimage.set_chr_rom_from_image_path(mmdata, chrin, chrmode, chrrect):
+                    print("Error: " + mmdata.errors_string())
+                    sys.exit(1)
 
         if jsonapply is not None:
             mmdata.deserialize_json_str(jsonapply)
@@ -263,23 +314,32 @@ def main():
         mmdata.startplayers = startplayers
         mmdata.startflag = startflag
 
-        if exportnes != "":
-            result = result and mmdata.write(exportnes)
+        # commit once, shared by all outputs
+        image = None
+        do_stat = not expimage and exportnes == "" and outfile != "" and len(mmdata.errors) == 0
+        if exportnes != "" or outpatch != "" or outbps != "" or do_stat:
+            if not do_stat:
+                mmdata.errors = []
+            image = mmdata.build()
+            result = result and image is not None
+
+        if exportnes != "" and image is not None:
+            result = result and mmdata.write(exportnes, image)
             
-        if outpatch != "":
-            result = result and mmdata.write_ips(outpatch)
+        if outpatch != "" and image is not None:
+            result = result and mmdata.write_ips(outpatch, image)
         
-        if outbps != "":
-            result = result and mmdata.write_bps(outbps)
+        if outbps != "" and image is not None:
+            result = result and mmdata.write_bps(outbps, image)
 
         if expimage:
             if not img_available:
                 print("Image export requires PIL (Pillow), which is not installed. (python3 -m pip install Pillow)")
             else:
-                src.mmimage.export_images(mmdata)
+                src.mmimage.export_images(mmdata, jobs=jobs)
 
-        if not expimage and exportnes == "" and outfile != "" and result and len(mmdata.errors) == 0:
-            mmdata.stat(outfile)
+        if do_stat and result:
+            mmdata.stat(outfile, image=image)
 
         if len(mmdata.errors) > 0:
             if result:
@@ -290,5 +350,10 @@ def main():
                 print("- " + error)
         sys.exit(0 if result else 1)
 
-if not as_lib:
+# (worker processes started by --jobs import this file as __mp_main__)
+if __name__ == "__main__":
+    # in a frozen build, worker processes run this file again; this hands them
+    # to multiprocessing instead of running main().
+    multiprocessing.freeze_support()
+if not as_lib and __name__ != "__mp_main__":
     main()
\ No newline at end of file
@@ -3,6 +3,7 @@ from parsimonious.grammar import Grammar
 from parsimonious.nodes import Node, NodeVisitor
 from parsimonious.exceptions import IncompleteParseError, ParseError
 from functools import reduce
+import functools
 
 mnemonics = {
 # machine instructions
@@ -254,6 +255,9 @@ def parseExpression(src):
     except ParseError as e:
         raise AsmException(f"Unable to parse expression: \"{src}\"")
 
+# lines are parsed independently of one another, so parses are reused
+# across calls to assemble(); only new or edited lines are parsed again.
+@functools.lru_cache(maxsize=0x1000)
 def parseline(line):
     if ';' in line:
         line = line[:line.index(';')]
@@ -0,0 +1,182 @@
+import json
+import multiprocessing
+import os
+import pickle
+import signal
+import time
+
+# batch builds: many hacks built against one decoded base ROM in a single process.
+#
+# the manifest is a json list of entries, each an object with these keys (all optional):
+#   "name": label used when reporting (defaults to the hack path)
+#   "hack": hack.txt file to apply
+#   "apply": json (object or string) to apply after the hack
+#   "nes", "ips", "bps": export the result to a rom / patch
+#   "txt": save the result as a hack.txt file
+#   "json": serialize the result to a json file, optionally restricted by "select"
+#   "png": render an image of the result: the stage with index "level" (in hard
+#          mode if "hard" is true), or the chr sheet if no level is given.
+# relative paths are relative to the manifest's folder.
+
+output_extensions = {
+    "nes": ".nes",
+    "ips": ".ips",
+    "bps": ".bps",
+}
+
+# returns the list of entries, or None (adding to errors) if the manifest is invalid.
+def read_manifest(path, errors):
+    try:
+        with open(path, "r") as f:
+            entries = json.load(f)
+    except (OSError, ValueError) as e:
+        errors += ["Unable to read batch manifest \"" + path + "\": " + str(e)]
+        return None
+    if type(entries) != list or not all(type(entry) == dict for entry in entries):
+        errors += ["Batch manifest \"" + path + "\" must be a list of objects."]
+        return None
+
+    # resolve paths relative to the manifest
+    folder = os.path.dirname(os.path.abspath(path))
+    for entry in entries:
+        for key in ["hack", "txt", "json", "png"] + list(output_extensions):
+            if key in entry:
+                entry[key] = os.path.join(folder, entry[key])
+    return entries
+
+def entry_name(entry, idx):
+    if "name" in entry:
+        return str(entry["name"])
+    if "hack" in entry:
+        return os.path.basename(entry["hack"])
+    return "entry " + str(idx + 1)
+
+# builds one manifest entry from a clone of the decoded base model.
+# returns (success, errors).
+def build_entry(base, entry):
+    for key in output_extensions:
+        if key in entry and not entry[key].endswith(output_extensions[key]):
+            return False, ["exported " + key.upper() + " must have " + output_extensions[key] + " extension."]
+
+    data = base.clone()
+    data.errors = []
+
+    if "hack" in entry:
+        if not data.parse(entry["hack"]):
+            return False, data.errors
+
+    if "apply" in entry:
+        j = entry["apply"]
+        if type(j) == str:
+            try:
+                j = json.loads(j)
+            except ValueError:
+                return False, ["json to apply is not valid json."]
+        if type(j) != dict:
+            return False, ["json to apply must be an object."]
+        # deserialize_json trusts the shape of its input, so a malformed hack surfaces as an exception.
+        try:
+            if not data.deserialize_json(j):
+                return False, data.errors
+        except (AttributeError, IndexError, KeyError, TypeError, ValueError):
+            return False, ["json to apply does not match the hack format."]
+
+    result = True
+    if "json" in entry:
+        j = data.serialize_json_str(entry.get("select", ""))
+        result = j != "null"
+        with open(entry["json"], "w") as f:
+            f.write(j)
+
+    if "png" in entry:
+        try:
+            import src.mmimage
+        except ImportError:
+            return False, ["Image export requires PIL (Pillow), which is not installed. (python3 -m pip install Pillow)"]
+        if "level" in entry:
+            task = (os.path.basename(entry["png"]), "level", int(entry["level"]), bool(entry.get("hard", False)))
+        else:
+            task = (os.path.basename(entry["png"]), "chr", None, False)
+        src.mmimage.export_task(data, os.path.dirname(entry["png"]), task)
+
+    if "txt" in entry or any(key in entry for key in output_extensions):
+        image = data.build()
+        if image is None:
+            return False, data.errors
+        if "nes" in entry:
+            result = data.write(entry["nes"], image) and result
+        if "ips" in entry:
+            result = data.write_ips(entry["ips"], image) and result
+        if "bps" in entry:
+            result = data.write_bps(entry["bps"], image) and result
+        if "txt" in entry:
+            result = data.stat(entry["txt"], image=image) and result
+
+    return result, data.errors
+
+# returns (success, errors, seconds taken, crashed); never raises.
+# crashed is True if the build failed with an unexpected exception (described in errors.)
+def timed_build_entry(base, entry):
+    t = time.perf_counter()
+    crashed = False
+    try:
+        result, errors = build_entry(base, entry)
+    except Exception as e:
+        result, errors, crashed = False, [type(e).__name__ + ": " + str(e)], True
+    return result, errors, time.perf_counter() - t, crashed
+
+# base model in a worker process
+batch_base = None
+
+# returns a pool of the given number of worker processes, each holding a copy of base.
+# (multiprocessing.Pool, as ProcessPoolExecutor only takes an initializer from python 3.7)
+def worker_pool(base, processes):
+    return multiprocessing.Pool(processes, init_batch_worker, (pickle.dumps(base),))
+
+def init_batch_worker(snapshot):
+    global batch_base
+    # interrupts are handled by the parent, which terminates the pool.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    batch_base = pickle.loads(snapshot)
+
+def batch_worker_task(entry):
+    return timed_build_entry(batch_base, entry)
+
+# builds every entry in the manifest, continuing past failures.
+# jobs: number of processes to build with.
+# prints one line per entry (in manifest order); returns True if all entries succeeded.
+def run_batch(base, path, jobs=1):
+    errors = []
+    entries = read_manifest(path, errors)
+    if entries is None:
+        for error in errors:
+            print("Error: " + error)
+        return False
+
+    # commit the base once, so that each clone only re-encodes what its hack changes.
+    start = time.perf_counter()
+    base.build()
+
+    failed = 0
+    pool = None
+    if jobs > 1 and len(entries) > 1:
+        # each worker unpickles the base model once, then clones it per entry.
+        pool = worker_pool(base, min(jobs, len(entries)))
+        results = pool.imap(batch_worker_task, entries)
+    else:
+        results = (timed_build_entry(base, entry) for entry in entries)
+
+    try:
+        for idx, (result, errors, t, crashed) in enumerate(results):
+            entry = entries[idx]
+            if not result:
+                failed += 1
+            print("[" + str(idx + 1) + "/" + str(len(entries)) + "] " + entry_name(entry, idx) + ": " + ("ok" if result else "FAILED") + " ({:.2f}s)".format(t), flush=True)
+            for error in errors:
+                print("  - " + error)
+    finally:
+        if pool is not None:
+            pool.terminate()
+
+    print(str(len(entries) - failed) + " of " + str(len(entries)) + " built ({:.2f}s).".format(time.perf_counter() - start))
+    return failed == 0
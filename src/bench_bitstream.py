@@ -0,0 +1,116 @@
+# micro-benchmark for the bit layer.
+# compares the word-level BitStream against the original bit-at-a-time
+# implementation by timing a full MMData.read() + commit() with each.
+#
+# usage: python3 -m src.bench_bitstream base.nes [iterations]
+
+import sys
+import time
+import math
+import src.mmdata
+import src.bitstream
+from src.mmdata import MMData
+
+# the original one-bit-per-call implementation, kept for reference.
+class ReferenceBitStream:
+    def __init__(self, bin, offset):
+        self.bin = bin
+        self.offset = offset
+        self.bitoffset = 0
+
+    def skip_bits(self, n):
+        for i in range(n):
+            self.read_bit()
+
+    def get_first_unread_byte(self):
+        return math.ceil(self.offset + (self.bitoffset / 8))
+
+    def get_next_byte_to_read(self):
+        return self.offset
+
+    def read_bit(self):
+        byte = self.bin[self.offset] & (1 << (7 - self.bitoffset))
+        self.bitoffset += 1
+        if self.bitoffset >= 8:
+            self.bitoffset = 0
+            self.offset += 1
+        if byte:
+            return 1
+        return 0
+
+    def read_bits(self, n):
+        c = 0
+        for i in range(n):
+            c *= 2
+            c = c | self.read_bit()
+        return c
+
+    def write_bit(self, bit):
+        mask = 1 << (7 - self.bitoffset)
+        self.bin[self.offset] = (self.bin[self.offset] & ~mask) | (mask if bit else 0)
+        self.bitoffset += 1
+        if self.bitoffset >= 8:
+            self.bitoffset = 0
+            self.offset += 1
+
+    def get_nibble_offset(self, fr=0):
+        assert(self.bitoffset % 4 == 0)
+        return 2 * (self.offset - fr) + (1 if self.bitoffset >= 4 else 0)
+
+    def write_bits(self, data, n):
+        for i in range(n):
+            self.write_bit((data >> (n - i - 1)) & 1)
+
+    def write_bits_list(self, bits):
+        for bit in bits:
+            self.write_bit(bit)
+
+    def write_bytes(self, data):
+        for b in data:
+            self.write_bits(b, 8)
+
+# returns (read seconds, commit seconds, committed image) using the given bitstream class
+def run(path, cls, iterations):
+    cache_dir = src.mmdata.decode_cache_dir
+    src.mmdata.BitStream = cls
+    try:
+        # read() would otherwise load the cached decode, bypassing the bitstream.
+        src.mmdata.decode_cache_dir = None
+        tread = 0
+        tcommit = 0
+        image = None
+        for i in range(iterations):
+            data = MMData()
+            t = time.perf_counter()
+            if not data.read(path):
+                raise Exception("; ".join(data.errors))
+            tread += time.perf_counter() - t
+            t = time.perf_counter()
+            if not data.commit():
+                raise Exception("; ".join(data.errors))
+            tcommit += time.perf_counter() - t
+            image = bytes(data.bin)
+        return tread / iterations, tcommit / iterations, image
+    finally:
+        src.mmdata.BitStream = src.bitstream.BitStream
+        src.mmdata.decode_cache_dir = cache_dir
+
+def main():
+    if len(sys.argv) < 2:
+        print("usage: python3 -m src.bench_bitstream base.nes [iterations]")
+        sys.exit(1)
+    path = sys.argv[1]
+    iterations = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    results = []
+    for name, cls in [("reference", ReferenceBitStream), ("word-level", src.bitstream.BitStream)]:
+        tread, tcommit, image = run(path, cls, iterations)
+        results.append(image)
+        print(f"{name:>10}: read {tread * 1000:8.2f} ms   commit {tcommit * 1000:8.2f} ms")
+
+    if results[0] != results[1]:
+        print("Error: committed images differ between implementations.")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,54 +1,87 @@
 import math
 
+# big-endian (msb-first) bit reader/writer over a byte buffer.
+# reads and writes move whole spans of bytes at a time by shifting and masking
+# a single integer, rather than looping bit-by-bit.
 class BitStream:
     def __init__(self, bin, offset):
         self.bin = bin
         self.offset = offset
         self.bitoffset = 0
-        
+
     def skip_bits(self, n):
-        for i in range(n):
-            self.read_bit()
-            
+        self.seek_bits(n)
+
     def get_first_unread_byte(self):
         return math.ceil(self.offset + (self.bitoffset / 8))
-    
+
     def get_next_byte_to_read(self):
         return self.offset
-    
+
+    # advances the stream position by n bits
+    def seek_bits(self, n):
+        p = self.bitoffset + n
+        self.offset += p >> 3
+        self.bitoffset = p & 7
+
+    # returns the bytes spanned by the next n bits as an int, plus the
+    # number of padding bits to the right of those n bits.
+    def _span(self, n):
+        end = self.offset + ((self.bitoffset + n + 7) >> 3)
+        if end > len(self.bin):
+            raise IndexError("bitstream read/write out of range")
+        chunk = int.from_bytes(self.bin[self.offset:end], "big")
+        return chunk, end, ((end - self.offset) << 3) - self.bitoffset - n
+
     def read_bit(self):
-        byte = self.bin[self.offset] & (1 << (7 - self.bitoffset))
-        self.bitoffset += 1
-        if self.bitoffset >= 8:
-            self.bitoffset = 0
-            self.offset += 1
+        byte = self.bin[self.offset] & (0x80 >> self.bitoffset)
+        self.seek_bits(1)
         if byte:
             return 1
         return 0
-        
+
     def read_bits(self, n):
-        c = 0
-        for i in range(n):
-            c *= 2
-            c = c | self.read_bit()
-        return c
-        
+        if n <= 0:
+            return 0
+        chunk, end, pad = self._span(n)
+        self.seek_bits(n)
+        return (chunk >> pad) & ((1 << n) - 1)
+
     def write_bit(self, bit):
-        mask = 1 << (7 - self.bitoffset)
+        mask = 0x80 >> self.bitoffset
         self.bin[self.offset] = (self.bin[self.offset] & ~mask) | (mask if bit else 0)
-        self.bitoffset += 1
-        if self.bitoffset >= 8:
-            self.bitoffset = 0
-            self.offset += 1
-            
+        self.seek_bits(1)
+
     def get_nibble_offset(self, fr=0):
         assert(self.bitoffset % 4 == 0)
         return 2 * (self.offset - fr) + (1 if self.bitoffset >= 4 else 0)
-    
+
+    # writes the low n bits of data, msb first.
     def write_bits(self, data, n):
-        for i in range(n):
-            self.write_bit((data >> (n - i - 1)) & 1)
-    
+        if n <= 0:
+            return
+        chunk, end, pad = self._span(n)
+        mask = ((1 << n) - 1) << pad
+        chunk = (chunk & ~mask) | ((data << pad) & mask)
+        self.bin[self.offset:end] = chunk.to_bytes(end - self.offset, "big")
+        self.seek_bits(n)
+
+    # writes a sequence of 0/1 values in a single store.
     def write_bits_list(self, bits):
+        v = 0
         for bit in bits:
-            self.write_bit(bit)
\ No newline at end of file
+            v = (v << 1) | (1 if bit else 0)
+        self.write_bits(v, len(bits))
+
+    # writes a sequence of whole bytes (need not be byte-aligned)
+    def write_bytes(self, data):
+        if len(data) == 0:
+            return
+        if self.bitoffset == 0:
+            end = self.offset + len(data)
+            if end > len(self.bin):
+                raise IndexError("bitstream read/write out of range")
+            self.bin[self.offset:end] = data
+            self.offset = end
+        else:
+            self.write_bits(int.from_bytes(data, "big"), 8 * len(data))
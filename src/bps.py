@@ -1,22 +1,90 @@
-import os
 import functools
 import binascii
-import math
 from src import constants
 
 # BPS file exporting.
 # format created by byuu
-# implementation by NaOH, tailored to optimize for bank insertions.
+# implementation by NaOH.
+#
+# the encoder is a greedy match-finder: at each target position it looks for
+# the longest match among SourceRead (same offset in source), SourceCopy (any
+# offset in source, found via a hash index over the source), and TargetCopy
+# (earlier output, including overlapping runs), falling back to TargetRead.
+
+# action types
+SourceRead = 0
+TargetRead = 1
+SourceCopy = 2
+TargetCopy = 3
+
+# bytes hashed to find match candidates; also the shortest copy considered.
+hash_length = 4
+
+# time/size tradeoff. effort selects how many candidates are examined per
+# position and whether lazy matching is used (see effort_settings).
+default_effort = 2
+
+# effort: (max candidates per index lookup, lazy matching, index inside matches)
+effort_settings = {
+    0: (1, False, False),
+    1: (8, False, True),
+    2: (32, True, True),
+    3: (256, True, True),
+}
+
+# returns the number of bytes BPS uses to store the given number
+def number_size(data):
+    n = 1
+    while data >= 0x80:
+        data = (data >> 7) - 1
+        n += 1
+    return n
+
+def signed_number_size(data):
+    return number_size((0 if data >= 0 else 1) | (abs(data) << 1))
+
+# returns the length of the common run a[ai:] == b[bi:], up to limit.
+# compares growing slices rather than single bytes.
+def match_length(a, ai, b, bi, limit):
+    n = 0
+    step = 16
+    while n < limit:
+        s = min(step, limit - n)
+        if a[ai + n:ai + n + s] == b[bi + n:bi + n + s]:
+            n += s
+            step <<= 1
+        elif s == 1:
+            break
+        else:
+            step = s >> 1
+    return n
+
+# hash index of every position in the given buffer.
+# cached, as many patches are usually made against the same source.
+@functools.lru_cache(maxsize=2)
+def source_index(org):
+    index = dict()
+    for p in range(len(org) - hash_length + 1):
+        key = org[p:p + hash_length]
+        if key in index:
+            index[key].append(p)
+        else:
+            index[key] = [p]
+    return index
 
 # misc data shared among functions in the bps patch production process
 class BPS:
-    def __init__(self, org, mod, f):
-        self.org = org
-        self.mod = mod
+    def __init__(self, org, mod, effort=default_effort):
+        self.org = bytes(org)
+        self.mod = bytes(mod)
         self.patch = bytearray()
-        self.f = f
         self.out = functools.partial(self.write)
 
+        self.max_candidates, self.lazy, self.index_matches = effort_settings[effort]
+        self.source_index = source_index(self.org)
+        self.target_index = dict()
+        self.target_indexed = 0
+
         # see BPS file format specification
         self.output_offset = 0
         self.source_relative_offset = 0
@@ -47,121 +115,239 @@ class BPS:
 
     def crc32(self, b):
         c = binascii.crc32(b)
-        self.out(bytes((
-            (c & 0x000000ff),
-            (c & 0x0000ff00) >> 8,
-            (c & 0x00ff0000) >> 16,
-            (c & 0xff000000) >> 24,
-        )))
+        self.out(c.to_bytes(4, "little"))
 
     def write(self, v):
-        self.f.write(v)
         self.patch += v
 
-    def delta(self, org_offset, length):
-        assert(length > 0)
-        dst_offset = self.output_offset + length
-        init_offset = self.output_offset
-        while self.output_offset < dst_offset:
-            matches = None
-            for offset in range(self.output_offset, dst_offset + 1):
-                if offset == dst_offset:
-                    if matches is None:
-                        break # paranoia
-                    # force a hunk to be written
-                    byte_matches = not matches
-                else:
-                    org_offset_byte = offset - init_offset + org_offset
-                    orgbyte = self.org[org_offset_byte]
-                    modbyte = self.mod[offset]
-                    byte_matches = orgbyte == modbyte
-                
-                if matches is None:
-                    matches = byte_matches
-                elif matches and not byte_matches:
-                    # hunk - copy
-                    self.copy(self.output_offset - init_offset + org_offset, offset - self.output_offset)
-                    break
-                elif byte_matches and not matches:
-                    # hunk - write
-                    self.insert(offset - self.output_offset)
-                    break
+    # adds target positions up to (not including) end to the target index
+    def index_target(self, end):
+        mod = self.mod
+        index = self.target_index
+        end = min(end, len(mod) - hash_length + 1)
+        for p in range(self.target_indexed, end):
+            key = mod[p:p + hash_length]
+            if key in index:
+                index[key].append(p)
+            else:
+                index[key] = [p]
+        self.target_indexed = max(self.target_indexed, end)
+
+    # returns the best (saving, action, offset, length) for the given target position.
+    # saving is the number of bytes saved relative to a TargetRead of the same length.
+    def find_match(self, i):
+        org = self.org
+        mod = self.mod
+        remaining = len(mod) - i
+        best = (0, None, 0, 0)
+
+        # SourceRead
+        if i < len(org):
+            length = match_length(org, i, mod, i, min(remaining, len(org) - i))
+            if length > 0:
+                saving = length - number_size((length - 1) << 2)
+                if saving > best[0]:
+                    best = (saving, SourceRead, i, length)
+
+        if remaining < hash_length:
+            return best
+        key = mod[i:i + hash_length]
+
+        # SourceCopy
+        candidates = self.source_index.get(key, ())
+        for p in candidates[-self.max_candidates:]:
+            if p == i:
+                continue
+            length = match_length(org, p, mod, i, min(remaining, len(org) - p))
+            saving = length - number_size((length - 1) << 2) - signed_number_size(p - self.source_relative_offset)
+            if saving > best[0]:
+                best = (saving, SourceCopy, p, length)
+                if length == remaining:
+                    return best
+
+        # TargetCopy (may overlap the output being written, e.g. for runs)
+        candidates = self.target_index.get(key, ())
+        for p in candidates[-self.max_candidates:]:
+            length = match_length(mod, p, mod, i, remaining)
+            saving = length - number_size((length - 1) << 2) - signed_number_size(p - self.target_relative_offset)
+            if saving > best[0]:
+                best = (saving, TargetCopy, p, length)
+                if length == remaining:
+                    return best
+
+        return best
+
+    # encodes mod[output_offset:end]
+    def delta(self, end):
+        literal = self.output_offset
+        i = self.output_offset
+        pending = None
+        while i < end:
+            self.index_target(i)
+            match = pending or self.find_match(i)
+            pending = None
+
+            # a match must pay for the TargetRead header it splits off
+            if match[0] <= 1 or match[3] > end - i:
+                i += 1
+                continue
+
+            if self.lazy and i + 1 < end:
+                self.index_target(i + 1)
+                pending = self.find_match(i + 1)
+                if pending[0] > match[0] + 1:
+                    i += 1
+                    continue
+                pending = None
+
+            if literal < i:
+                self.insert(i - literal)
+            action, offset, length = match[1], match[2], match[3]
+            if action == TargetCopy:
+                self.target_copy(offset, length)
+            else:
+                self.copy(offset, length)
+            i += length
+            literal = i
+            if not self.index_matches:
+                self.target_indexed = i
+
+        if literal < end:
+            self.insert(end - literal)
+        assert(self.output_offset == end)
 
     def copy(self, org_offset, length):
         assert(length > 0)
         if org_offset == self.output_offset:
             # SourceRead
-            self.encode_action_header(0, length)
+            self.encode_action_header(SourceRead, length)
         else:
             # SourceCopy
-            self.encode_action_header(2, length)
+            self.encode_action_header(SourceCopy, length)
             self.encode_signed_number(org_offset - self.source_relative_offset)
             self.source_relative_offset = org_offset + length
         self.output_offset += length
 
-    def insert(self, length):
+    def target_copy(self, mod_offset, length):
         assert(length > 0)
-        # optimization -- encode RLE for last section of patch section
-        """rle_end = length
-        orglength = length
-        apply_rle = False
-        while rle_end > 0:
-            if self.mod[self.output_offset + rle_end] != self.mod[self.output_offset + length - 1]:
-                break
-            rle_end -= 1
-        
-        if rle_end < length - 5:
-            apply_rle = True
-            rle_end += 1 # TargetRead section should encode one of the bytes so we can RLE copy it.
-            length = rle_end"""
+        assert(mod_offset < self.output_offset)
+        self.encode_action_header(TargetCopy, length)
+        self.encode_signed_number(mod_offset - self.target_relative_offset)
+        self.target_relative_offset = mod_offset + length
+        self.output_offset += length
 
+    def insert(self, length):
         assert(length > 0)
         # TargetRead
-        self.encode_action_header(1, length)
+        self.encode_action_header(TargetRead, length)
         self.write(
             self.mod[self.output_offset:self.output_offset+length]
         )
         self.output_offset += length
 
-        """if apply_rle:
-            # RLE encode to repeat the last byte written.
-            length = orglength - rle_end
-            assert(length > 0)
+# returns the bps patch (as bytes) transforming org into mod.
+def encode_patch(org, mod, effort=default_effort):
+    bps = BPS(org, mod, effort)
+
+    # write header
+    bps.out(bytes("BPS1", "ascii"))
+    bps.encode_number(len(org))
+    bps.encode_number(len(mod))
+    metadata = bytes("Generated by " + constants.mmname + ". fmt " + str(constants.mmfmt), "utf-8")
+    bps.encode_number(len(metadata))
+    bps.out(metadata)
+
+    bps.delta(len(mod))
 
-            # TargetCopy
-            self.encode_action_header(3, length)
-            self.encode_signed_number(self.output_offset - 1 - self.target_relative_offset)
-            self.target_relative_offset = self.output_offset + length
+    # write crc32
+    bps.crc32(bps.org)
+    bps.crc32(bps.mod)
+    bps.crc32(bps.patch)
+    return bytes(bps.patch)
 
-            self.output_offset += length"""
+# applies the given patch to org; returns the result, or None if the patch is invalid.
+def apply_patch(org, patch):
+    pos = 0
+
+    def decode_number():
+        nonlocal pos
+        data = 0
+        shift = 1
+        while True:
+            x = patch[pos]
+            pos += 1
+            data += (x & 0x7f) * shift
+            if x & 0x80:
+                return data
+            shift <<= 7
+            data += shift
+
+    def decode_signed_number():
+        data = decode_number()
+        return (-1 if data & 1 else 1) * (data >> 1)
+
+    try:
+        if patch[0:4] != b"BPS1" or len(patch) < 16:
+            return None
+        if int.from_bytes(patch[-4:], "little") != binascii.crc32(patch[:-4]):
+            return None
+        if int.from_bytes(patch[-12:-8], "little") != binascii.crc32(org):
+            return None
+        pos = 4
+        if decode_number() != len(org):
+            return None
+        mod = bytearray(decode_number())
+        metadata_length = decode_number()
+        pos += metadata_length
+
+        output_offset = 0
+        source_relative_offset = 0
+        target_relative_offset = 0
+        while pos < len(patch) - 12:
+            data = decode_number()
+            action = data & 3
+            length = (data >> 2) + 1
+            if output_offset + length > len(mod):
+                return None
+            if action == SourceRead:
+                mod[output_offset:output_offset + length] = org[output_offset:output_offset + length]
+            elif action == TargetRead:
+                mod[output_offset:output_offset + length] = patch[pos:pos + length]
+                pos += length
+            elif action == SourceCopy:
+                source_relative_offset += decode_signed_number()
+                if source_relative_offset < 0 or source_relative_offset + length > len(org):
+                    return None
+                mod[output_offset:output_offset + length] = org[source_relative_offset:source_relative_offset + length]
+                source_relative_offset += length
+            else:
+                target_relative_offset += decode_signed_number()
+                if target_relative_offset < 0 or target_relative_offset >= output_offset:
+                    return None
+                # copied byte-by-byte, as the source may overlap the output.
+                for j in range(length):
+                    mod[output_offset + j] = mod[target_relative_offset + j]
+                target_relative_offset += length
+            output_offset += length
+
+        if output_offset != len(mod) or pos != len(patch) - 12:
+            return None
+        if int.from_bytes(patch[-8:-4], "little") != binascii.crc32(mod):
+            return None
+        return bytes(mod)
+    except IndexError:
+        return None
 
 # creates an org -> mod patch, saves it in the given file.
+# the patch is applied in-process before saving to verify that it reproduces mod.
 # returns True on success.
-def create_patch(org, mod, file):
+def create_patch(org, mod, file, effort=default_effort):
+    patch = encode_patch(org, mod, effort)
+    if apply_patch(org, patch) != bytes(mod):
+        return False
+
     with open(file, "wb") as f:
-        bps = BPS(org, mod, f)
-
-        # write header
-        bps.out(bytes("BPS1", "ascii"))
-        bps.encode_number(len(org))
-        bps.encode_number(len(mod))
-        metadata = bytes("Generated by " + constants.mmname + ". fmt " + str(constants.mmfmt), "utf-8")
-        bps.encode_number(len(metadata))
-        bps.out(metadata)
-
-        # encode NES header and first bank
-        bps.delta(0x0, 0x4010)
-        assert(bps.output_offset == 0x4010)
-
-        for j in range(0x4010, len(mod) - 0x6000, 0x4000):
-            # add new inserted banks
-            bps.insert(0x4000)
-            assert(bps.output_offset == j + 0x4000)
-
-        # encode last bank and chr
-        bps.delta(0x4010, 0x6000)
-
-        # write crc32
-        bps.crc32(org)
-        bps.crc32(mod)
-        bps.crc32(bps.patch)
\ No newline at end of file
+        f.write(patch)
+        return True
+
+    return False
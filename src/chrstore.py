@@ -0,0 +1,82 @@
+# storage for chr tile data, indexed chr[page][image][y][x] (2-bit colour indices).
+#
+# if numpy is available, the tiles are held in a single (2, 0x100, 8, 8) uint8
+# array, decoded from and encoded to the planar NES format in one vectorized
+# pass. The array supports the same chained indexing and tile assignment as
+# the nested lists used otherwise.
+
+available = True
+
+try:
+    import numpy
+except ImportError as e:
+    available = False
+
+page_size = 0x1000
+tile_size = 0x10
+
+# returns chr[page][image][y][x] for the given planar chr data (a whole number of pages)
+def decode(b):
+    pages = len(b) // page_size
+    if available:
+        planes = numpy.frombuffer(bytes(b[:pages * page_size]), dtype=numpy.uint8).reshape(pages, 0x100, 2, 8, 1)
+        bits = numpy.unpackbits(planes, axis=4)
+        return bits[:, :, 0] | (bits[:, :, 1] << 1)
+
+    chr = []
+    for page in range(pages):
+        tiles = []
+        for img in range(0x100):
+            o = page * page_size + img * tile_size
+            tiles.append([
+                [((b[o + y] >> (7 - x)) & 1) | (((b[o + y + 8] >> (7 - x)) & 1) << 1) for x in range(8)]
+                for y in range(8)
+            ])
+        chr.append(tiles)
+    return chr
+
+# returns the planar chr data for a page (or list of pages) of tiles.
+def encode(tiles):
+    if available:
+        arr = numpy.asarray(tiles, dtype=numpy.uint8).reshape(-1, 8, 8)
+        planes = numpy.stack((arr & 1, (arr >> 1) & 1), axis=1)
+        return numpy.packbits(planes, axis=3).tobytes()
+
+    if len(tiles) > 0 and type(tiles[0][0][0]) is list:
+        return b"".join(encode(page) for page in tiles)
+    out = bytearray()
+    for img in tiles:
+        for k in range(2):
+            for row in img:
+                v = 0
+                for pix in row:
+                    v = (v << 1) | ((pix >> k) & 1)
+                out.append(v)
+    return bytes(out)
+
+# converts nested lists chr[page][image][y][x] to the store format
+def from_lists(chr):
+    if available:
+        return numpy.array(chr, dtype=numpy.uint8).reshape(-1, 0x100, 8, 8)
+    return chr
+
+# returns a hashable value which changes whenever the page's contents do
+def signature(page):
+    if available:
+        return numpy.asarray(page, dtype=numpy.uint8).tobytes()
+    return tuple(tuple(row) for img in page for row in img)
+
+# returns the given tile as nested lists of ints, tile[y][x]
+def tile(chr, page, img):
+    t = chr[page][img]
+    if hasattr(t, "tolist"):
+        return t.tolist()
+    return t
+
+# returns a list with one bool per tile, true where the planar chr data a and b differ.
+def changed_tiles(a, b):
+    if available:
+        a = numpy.frombuffer(bytes(a), dtype=numpy.uint8).reshape(-1, tile_size)
+        b = numpy.frombuffer(bytes(b), dtype=numpy.uint8).reshape(-1, tile_size)
+        return (a != b).any(axis=1).tolist()
+    return [a[o:o + tile_size] != b[o:o + tile_size] for o in range(0, len(a), tile_size)]
@@ -1,73 +1,128 @@
-import os
-import functools
+import re
 
 ascii = bytes((0x50, 0x41, 0x54, 0x43, 0x48))
 eof = bytes((0x45, 0x4f, 0x46))
 eofint = 0x454f46
 
 filemax = 0x1000000
+hunkmax = 0xffff
 
-# writes the end of the hunk
-def endhunk(out, hunk):
-    size = bytearray(2)
-    for i in range(2):
-        size[i] = (len(hunk) >> (8 if i == 0 else 0)) & 0xff
-    out(size)
-    out(hunk)
+# per-record overhead, in bytes
+header_size = 5 # offset (3), size (2)
+rle_size = 8 # offset (3), zero (2), count (2), value (1)
+
+# runs of changed bytes in the xor of the two files
+re_changed = re.compile(rb"[^\x00]+")
+
+# runs of at least 4 identical bytes (fewer is never worth an RLE record)
+re_repeat = re.compile(rb"(.)\1{3,}", re.DOTALL)
+
+# returns [(start, end)] for each contiguous range in which org and mod differ.
+# bytes past the end of org are considered changed.
+def changed_ranges(org, mod):
+    n = min(len(org), len(mod))
+    diff = (int.from_bytes(org[:n], "big") ^ int.from_bytes(mod[:n], "big")).to_bytes(n, "big")
+    ranges = [m.span() for m in re_changed.finditer(diff)]
+    if len(mod) > n:
+        if len(ranges) > 0 and ranges[-1][1] == n:
+            ranges[-1] = (ranges[-1][0], len(mod))
+        else:
+            ranges.append((n, len(mod)))
+    return ranges
+
+# joins ranges separated by gaps too short to be worth a record header
+def merge_ranges(ranges):
+    merged = []
+    for start, end in ranges:
+        if len(merged) > 0 and start - merged[-1][1] < header_size:
+            merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+# splits the range into records: (start, data) or (start, count, value) for RLE.
+# a repeated run is RLE-encoded when that is smaller than storing it inline.
+def split_range(mod, start, end):
+    records = []
+    span = mod[start:end]
+    p = 0
+    for m in re_repeat.finditer(span):
+        a, b = m.span()
+        # cost of the record header(s) the run would split off on either side
+        split_cost = rle_size - header_size
+        if a > p:
+            split_cost += header_size
+        if b < len(span):
+            split_cost += header_size
+        if b - a <= split_cost:
+            continue
+        if a > p:
+            records.append((start + p, bytes(span[p:a])))
+        records.append((start + a, b - a, span[a]))
+        p = b
+    if p < len(span):
+        records.append((start + p, bytes(span[p:])))
+    return records
+
+def encode_record(out, record):
+    start = record[0]
+    out += start.to_bytes(3, "big")
+    if len(record) == 2:
+        data = record[1]
+        out += len(data).to_bytes(2, "big")
+        out += data
+    else:
+        count, value = record[1], record[2]
+        out += bytes((0, 0))
+        out += count.to_bytes(2, "big")
+        out.append(value)
+
+# returns the org -> mod patch as bytes, or None if it cannot be expressed.
+def encode_patch(org, mod):
+    if len(mod) > filemax or len(mod) < len(org):
+        return None
+
+    out = bytearray(ascii)
+    for start, end in merge_ranges(changed_ranges(org, mod)):
+        for record in split_range(mod, start, end):
+            # chop records to the maximum record length
+            while True:
+                # a record cannot start at the offset which spells "EOF";
+                # start it one byte earlier instead. (done before chopping,
+                # so that the record's length is still limited to hunkmax.)
+                if record[0] == eofint:
+                    if len(record) == 2:
+                        record = (eofint - 1, bytes((mod[eofint - 1],)) + record[1])
+                    else:
+                        encode_record(out, (eofint - 1, mod[eofint - 1:eofint + 1]))
+                        record = (eofint + 1, record[1] - 1, record[2])
+                        if record[1] == 0:
+                            break
+
+                if len(record) == 2:
+                    piece = (record[0], record[1][:hunkmax])
+                    rest = (record[0] + hunkmax, record[1][hunkmax:]) if len(record[1]) > hunkmax else None
+                else:
+                    piece = (record[0], min(record[1], hunkmax), record[2])
+                    rest = (record[0] + hunkmax, record[1] - hunkmax, record[2]) if record[1] > hunkmax else None
+                encode_record(out, piece)
+
+                if rest is None:
+                    break
+                record = rest
+
+    out += eof
+    return bytes(out)
 
 # creates an org -> mod patch, saves it in the given file.
 # returns True on success.
 def create_patch(org, mod, file):
-    assert(len(org) == len(mod))
-    assert(len(mod) < filemax)
-    
+    patch = encode_patch(org, mod)
+    if patch is None:
+        return False
+
     with open(file, "wb") as f:
-        out = functools.partial(f.write)
-        out(ascii)
-        write = False
-        for i in range(len(mod)):
-            if not write:
-                if org[i] != mod[i]:
-                    hunk = bytearray()
-                    
-                    # hacky fix for the eof-int problem
-                    if i == eofint:
-                        hunk.append(mod[i-1])
-                    
-                    hunk.append(mod[i])
-                    
-                    # write starting position of chunk
-                    position = bytearray(3)
-                    for j in range(3):
-                        position[j] = (i >> (0x10 - j * 8)) & 0xff
-                    
-                    write = True
-                    
-                    out(position)
-            else:
-                # check the next 5 bytes for differences.
-                # if any are different, append *this* byte.
-                """for j in reversed(range(5)):
-                    if i + j >= len(mod):
-                        continue
-                    if org[i + j] != mod[i + j]:
-                        hunk.append(mod[i])
-                        break
-                    if j == 0:
-                        write = False
-                        endhunk(f, hunk)
-                        break"""
-                if org[i] != mod[i]:
-                    hunk.append(mod[i])
-                else:
-                    write = False
-                    endhunk(out, hunk)
-                    
-            # end of mod reached.
-            if write and i == len(mod) - 1:
-                endhunk(out, hunk)
-        
-        out(eof)
+        f.write(patch)
         return True
-    
-    return False
\ No newline at end of file
+
+    return False
@@ -4,45 +4,131 @@ from src import constants
 import json
 import functools
 import hashlib
+import bisect
 import src.ips
 import src.bps
 import src.mappermages
 import src.jsonpath
 import src.asm6502
+import src.chrstore
 import copy
 import os
+import io
+import sys
+import pickle
+import threading
 
 breakpoint_on_byte_edit = False
 
+# decoded base ROMs (those in constants.base_hashes) are cached here, keyed by
+# the ROM's md5 and a fingerprint of the code. (None disables the cache.)
+default_decode_cache_dir = os.path.join(os.path.expanduser("~"), ".cache", "mmagedit")
+decode_cache_dir = default_decode_cache_dir
+decode_cache_format = 1
+
+# changes whenever the source of any module the decoded model is built from
+# changes, so that a cache written by a different version of the code is not loaded.
+@functools.lru_cache(maxsize=1)
+def decode_cache_fingerprint():
+    hasher = hashlib.md5((constants.mmname + str(constants.mmfmt) + str(decode_cache_format) + str(src.chrstore.available)).encode("utf-8"))
+    folder = os.path.dirname(os.path.abspath(__file__))
+    try:
+        for subfolder in [folder, os.path.join(folder, "objects")]:
+            for file in sorted(os.listdir(subfolder)):
+                if file.endswith(".py"):
+                    with open(os.path.join(subfolder, file), "rb") as f:
+                        hasher.update(f.read())
+    except OSError:
+        # (e.g. a frozen build, in which the source is not available; the version is used alone.)
+        pass
+    return hasher.hexdigest()[:16]
+
+# the MMData being cloned by this thread, if any; see MMData.clone()
+cloning = threading.local()
+
+# attributes (of MMData and of its commit cache) which clone() shares rather than copies
+clone_buffers = ["orgbin", "bin", "base", "image"]
+
+# MMData attributes which are not part of the decoded model
+decode_cache_exclude = [
+    "orgbin", "bin", "errors", "commit_cache", "asm_cache",
+    "startlevel", "startdifficulty", "startscreen", "startflag", "startplayers"
+]
+
+# pickles the decoded model; references to the MMData itself are stored by id
+# so that they are restored to whichever instance loads the snapshot.
+class DecodeCachePickler(pickle.Pickler):
+    def __init__(self, file, data):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.data = data
+    
+    def persistent_id(self, obj):
+        return "data" if obj is self.data else None
+
+class DecodeCacheUnpickler(pickle.Unpickler):
+    def __init__(self, file, data):
+        super().__init__(file)
+        self.data = data
+    
+    def persistent_load(self, pid):
+        if pid != "data":
+            raise pickle.UnpicklingError("unknown persistent id")
+        return self.data
+
+# accumulates a bit sequence (msb first) in a single integer,
+# tracking its length so that size queries are O(1).
+class BitAccumulator:
+    def __init__(self):
+        self.value = 0
+        self.nbits = 0
+
+    def push(self, value, n):
+        self.value = (self.value << n) | (value & ((1 << n) - 1))
+        self.nbits += n
+
+    def length_bits(self):
+        return self.nbits
+
+    def length_bytes(self):
+        return (self.nbits + 7) // 8
+
+    # zero-padded to a whole number of bytes
+    def to_bytes(self):
+        pad = self.length_bytes() * 8 - self.nbits
+        return (self.value << pad).to_bytes(self.length_bytes(), "big")
+
+    # writes the sequence into bin at the given offset.
+    # padding bits in the final byte are left as they were.
+    def splice(self, bin, offset):
+        out = self.to_bytes()
+        if len(out) == 0:
+            return
+        pad = len(out) * 8 - self.nbits
+        if pad > 0:
+            out = out[:-1] + bytes((out[-1] | (bin[offset + len(out) - 1] & ((1 << pad) - 1)),))
+        bin[offset:offset + len(out)] = out
+
 # this is used for the optional single-med-tile patching mod
 # represents the bit sequence for the patches
-class UnitileStream:
+class UnitileStream(BitAccumulator):
     def __init__(self):
-        self.entries = []
+        BitAccumulator.__init__(self)
         self.i = 0
         self.complete = False
+        
+        # bit offset of the start of each region, or -1 if not present
         self.region_starts = [-1, -1, -1, -1]
+        
+        # bit offset of the previous patch's flag byte, if its low bits can still encode an advance.
         self.prev_byte = None
     
     def length_bits(self):
         assert(self.complete)
-        l = 0
-        for entry in self.entries:
-            l += len(entry)
-        return l
-        
-    def length_bytes(self):
-        lb = self.length_bits()
-        if lb % 8 == 0:
-            return int(lb / 8)
-        else:
-            return int(lb / 8) + 1
+        return self.nbits
     
-    def as_bits(self, value, n):
-        l = []
-        for i in range(n):
-            l.append(0 if value & (1 << (n - i - 1)) == 0 else 1)
-        return l
+    # true if the stream contains anything besides its terminator
+    def has_patches(self):
+        return self.length_bits() > 8
     
     def add_patch(self, patch):
         assert(not self.complete)
@@ -65,7 +151,7 @@ class UnitileStream:
                 self.add_patch(up)
         
             if self.i == region_boundary and self.region_starts[j] == -1:
-                self.region_starts[j] = len(self.entries)
+                self.region_starts[j] = self.nbits
         
         # write 'advance' tokens
         while patch.get_i() > self.i:
@@ -83,23 +169,25 @@ class UnitileStream:
             if idiff == 0x41:
                 idiff = 0x1D
             if self.prev_byte is None:
-                self.entries.append([1] * 3 + self.as_bits(idiff, 5))
+                self.push(0xE0 | idiff, 8)
             else:
-                self.entries[-2] = self.prev_byte[:3] + self.as_bits(idiff, 5)
+                # store the advance in the low 5 bits of the previous flag byte
+                shift = self.nbits - self.prev_byte - 8
+                self.value = (self.value & ~(0x1F << shift)) | (idiff << shift)
                 self.prev_byte = None
         
         # write patch byte
         if patch.med_tile_idx is not None:
-            self.entries.append(self.as_bits(patch.get_flags(), 8))
-            self.entries.append(self.as_bits(patch.med_tile_idx, 8))
-            self.prev_byte = self.entries[-2]
+            self.prev_byte = self.nbits
+            self.push(patch.get_flags(), 8)
+            self.push(patch.med_tile_idx, 8)
         else:
             self.prev_byte = None
     
     def finalize(self):
         assert(not self.complete)
         self.complete = True
-        self.entries.append( self.as_bits(0xFE, 8) )
+        self.push(0xFE, 8)
 
 # represents the bit sequence for hard mode patches in a stage
 class PatchStream:
@@ -150,32 +238,16 @@ class PatchStream:
         self.entries.append(patch.i << 4)
 
 # represents the bit sequence for the object data in a level
-class ObjectStream:
+class ObjectStream(BitAccumulator):
     def __init__(self, data, maxy):
-        self.entries = []
+        BitAccumulator.__init__(self)
         self.y = maxy # in microtiles (8 pixels)
         self.complete = False
         self.data = data
     
     def length_bits(self):
         assert(self.complete)
-        l = 0
-        for entry in self.entries:
-            l += len(entry)
-        return l
-        
-    def length_bytes(self):
-        lb = self.length_bits()
-        if lb % 8 == 0:
-            return int(lb / 8)
-        else:
-            return int(lb / 8) + 1
-    
-    def as_bits(self, value, n):
-        l = []
-        for i in range(n):
-            l.append(0 if value & (1 << (n - i - 1)) == 0 else 1)
-        return l
+        return self.nbits
     
     def add_object(self, obj):
         assert(not self.complete)
@@ -188,23 +260,27 @@ class ObjectStream:
         while obj.y < self.y:
             ydiff = max(1, min(self.y - obj.y, 8))
             self.y -= ydiff
-            self.entries.append( [0, 0] + self.as_bits(ydiff - 1, 3) )
+            self.push(0b00, 2)
+            self.push(ydiff - 1, 3)
         
         if (obj.compressible()):
-            self.entries.append( [1, 0] + self.as_bits(int((obj.x - 1) / 2), 4) + self.as_bits(obj.get_i(), 4) )
+            self.push(0b10, 2)
+            self.push(int((obj.x - 1) / 2), 4)
+            self.push(obj.get_i(), 4)
         else:
-            self.entries.append(
-                  [0, 1]
-                + [1 if obj.flipy else 0]
-                + [1 if obj.flipx else 0]
-                + self.as_bits(obj.x, 5)
-                + (self.as_bits(obj.gid, 6) if self.data.has_mod("extended_objects") else self.as_bits(obj.get_i(), 5))
-            )
+            self.push(0b01, 2)
+            self.push(1 if obj.flipy else 0, 1)
+            self.push(1 if obj.flipx else 0, 1)
+            self.push(obj.x, 5)
+            if self.data.has_mod("extended_objects"):
+                self.push(obj.gid, 6)
+            else:
+                self.push(obj.get_i(), 5)
     
     def finalize(self):
         assert(not self.complete)
         self.complete = True
-        self.entries.append( [1, 1] )
+        self.push(0b11, 2)
 
 class Patch:
     def __init__(self, is_rom):
@@ -360,6 +436,53 @@ class Level:
         self.hardmode_patches = []
         self.unitile_patches = []
         
+        # (y, x) -> patch i; see get_patch_index()
+        self.patch_index = dict()
+        self.patch_index_signature = None
+        
+        # hardmode -> {macro row: (signature, med-tile rows)}; see produce_med_tiles()
+        self.med_tile_cache = dict()
+        
+        # cached encoded streams; see invalidate()
+        self.stream_cache = dict()
+        self.stream_cache_key = None
+    
+    # discards cached encodings of this level.
+    # must be called after editing this level's objects, hardmode patches,
+    # unitile patches, or macro rows.
+    def invalidate(self):
+        self.stream_cache = dict()
+    
+    def get_cached_stream(self, name, produce):
+        # encodings also depend on these global settings
+        key = (self.data.has_mod("extended_objects"), tuple(self.data.spawnable_objects))
+        if key != self.stream_cache_key:
+            self.stream_cache = dict()
+            self.stream_cache_key = key
+        if name not in self.stream_cache:
+            self.stream_cache[name] = produce()
+        return self.stream_cache[name]
+    
+    def get_patches_stream(self):
+        return self.get_cached_stream("patches", self.produce_patches_stream)
+    
+    def get_objects_stream(self):
+        return self.get_cached_stream("objects", self.produce_objects_stream)
+    
+    def get_unitile_stream(self):
+        return self.get_cached_stream("unitile", self.produce_unitile_stream)
+    
+    # changes whenever this level's committed data would change.
+    # (the cached streams are compared by identity.)
+    def commit_signature(self):
+        return (
+            self.music_idx,
+            tuple((macro_row.seam, tuple(macro_row.macro_tiles)) for macro_row in self.macro_rows),
+            self.get_patches_stream(),
+            self.get_objects_stream(),
+            self.get_unitile_stream() if self.data.mapper_extension else None
+        )
+        
     def get_ppu_scroll_for_checkpoint(self, idx):
         if idx is not None:
             for obj in self.objects:
@@ -449,6 +572,7 @@ class Level:
             else:
                 self.data.errors += ["unrecognized key \"" + key + "\""]
                 return False
+            self.invalidate()
         return True
     
     def get_name(self, hard=False):
@@ -461,6 +585,7 @@ class Level:
     def read(self):
         self.macro_rows = []
         self.objects = []
+        self.invalidate()
         
         # get music index
         self.music_idx = self.data.read_byte(self.data.ram_to_rom(constants.ram_music_table + self.level_idx))
@@ -542,13 +667,13 @@ class Level:
                 self.objects.append(obj)
         
     def length_bytes(self, include_macro_rows=True):
-        ps = self.produce_patches_stream()
-        os = self.produce_objects_stream()
+        ps = self.get_patches_stream()
+        os = self.get_objects_stream()
         return os.length_bytes() + ps.length_bytes() + (4 * self.macro_row_count if include_macro_rows else 0) + 1
     
     def length_unitile_bytes(self):
-        us = self.produce_unitile_stream()
-        if len(us.entries) <= 1:
+        us = self.get_unitile_stream()
+        if not us.has_patches():
             return 0
         return us.length_bytes()
     
@@ -580,6 +705,7 @@ class Level:
     def split_unitiles_by_difficulty(self):
         old_unitiles = self.unitile_patches
         self.unitile_patches = []
+        self.invalidate()
         for u in old_unitiles:
             if u.med_tile_idx is not None:
                 for j in range(3):
@@ -598,6 +724,7 @@ class Level:
 
     def combine_unitiles_by_difficulty(self):
         old_unitiles = self.unitile_patches
+        old_signature = [(u.x, u.y, u.med_tile_idx, u.get_flags()) for u in old_unitiles]
         self.unitile_patches = []
         for u in old_unitiles:
             # don't add if the tile is vacuous (would not appear on any difficulty)
@@ -618,6 +745,10 @@ class Level:
                         v.flag_normal = v.flag_normal or u.flag_normal
                         v.flag_hard = v.flag_hard or u.flag_hard
                         v.flag_hell = v.flag_hell or u.flag_hell
+        
+        # the stream encoding depends on the representation.
+        if old_signature != [(u.x, u.y, u.med_tile_idx, u.get_flags()) for u in self.unitile_patches]:
+            self.invalidate()
     
     def length_object_drops_bytes(self):
         length = 0
@@ -671,24 +802,21 @@ class Level:
         
         # write unitile data sequence
         self.combine_unitiles_by_difficulty()
-        us = self.produce_unitile_stream()
-        bs = BitStream(self.data.bin, rom)
-        
-        if len(us.entries) > 1: # we skip if there are no unitiles at all.
-            for i in range(len(us.entries)):
-                if i in us.region_starts:
-                    idx = us.region_starts.index(i)
+        us = self.get_unitile_stream()
+        if us.has_patches(): # we skip if there are no unitiles at all.
+            for idx, region_start in enumerate(us.region_starts):
+                if region_start != -1:
                     rom_table_location = self.data.ram_to_rom(table_start + 8 * self.level_idx + 2 * idx)
-                    self.data.write_word(rom_table_location, bs.offset - rom + ram)
-                entry = us.entries[i]
-                bs.write_bits_list(entry)
+                    self.data.write_word(rom_table_location, ram + region_start // 8)
+            us.splice(self.data.bin, rom)
+            return True, ram + us.length_bytes()
             
-        return True, ram + self.length_unitile_bytes()
+        return True, ram
     
     # returns error, new ram output location
     def commit(self, ram):
-        ps = self.produce_patches_stream()
-        os = self.produce_objects_stream()
+        ps = self.get_patches_stream()
+        os = self.get_objects_stream()
         
         # write music index
         self.data.write_byte(self.data.ram_to_rom(constants.ram_music_table + self.level_idx), self.music_idx)
@@ -711,11 +839,9 @@ class Level:
             self.data.write_byte(rom + 4 * self.macro_row_count + 1 + i, entry)
 
         # write objects data
-        bs = BitStream(self.data.bin, rom + 4 * self.macro_row_count + 1 + ps.length_bytes())
-        for entry in os.entries:
-            bs.write_bits_list(entry)
+        os.splice(self.data.bin, rom + 4 * self.macro_row_count + 1 + ps.length_bytes())
         
-        return True, ram + self.length_bytes()
+        return True, ram + os.length_bytes() + ps.length_bytes() + 4 * self.macro_row_count + 1
         
     def produce_patches_stream(self):
         ps = PatchStream(self.data)
@@ -755,52 +881,84 @@ class Level:
         
     def get_macro_patch_tile(self, patch_i):
         return 0x2f + patch_i
-        
+    
+    # returns {(y, x): i} for the hardmode patches. where several patches
+    # share a position, the last one in the list wins.
+    # rebuilt only when the patches have changed.
+    def get_patch_index(self):
+        signature = tuple((patch.y, patch.x, patch.i) for patch in self.hardmode_patches)
+        if self.patch_index_signature != signature:
+            self.patch_index = {(y, x): i for y, x, i in signature}
+            self.patch_index_signature = signature
+        return self.patch_index
+        
+    # returns {med-tile row: [(x, med_tile_idx)]} for the unitiles which
+    # appear on the given difficulty, in list order (later entries win).
+    def get_unitile_row_index(self, hardmode=False):
+        unitile_flag = 0x40 if hardmode else 0x80 # TODO: hellmode?
+        index = dict()
+        for ut in self.unitile_patches:
+            if ut.get_flags() & unitile_flag == 0:
+                index.setdefault(ut.y, []).append((ut.x, ut.med_tile_idx))
+        return index
+    
     # constructs rows of medtiles (and macrotiles) from bottom up.
     # dimensions should be YX, 64x16
+    #
+    # each macro row's pair of med-tile rows is cached per difficulty, and is
+    # rebuilt only when something it was built from has changed (its macro
+    # tiles, seam, hardmode patch, unitiles, or the world's tiles/mirroring).
+    # the returned rows are shared with the cache and must not be modified.
     def produce_med_tiles(self, hardmode=False, orows=None):
         if orows is None:
             orows = range(self.macro_row_count)
         rows = []
         macro_tile_idxs = []
-        if self.data.mapper_extension:
-            unitile_j = (1 if hardmode else 0) # TODO: hellmode?
-            unitile_rows = self.produce_unitile_rows()
+        mirror = self.world.get_mirror_table()
+        patch_index = self.get_patch_index() if hardmode else None
+        unitile_rows = self.get_unitile_row_index(hardmode) if self.data.mapper_extension else dict()
+        cache = self.med_tile_cache.setdefault(hardmode, dict())
         for y in orows:
             lmr = self.macro_rows[y]
-            row = [[0] * 16, [0] * 16]
-            for i in range(4):
-                macro_tile_idx = lmr.macro_tiles[i]
-                if hardmode:
-                    for patch in self.hardmode_patches:
-                        if y == patch.y:
-                            if i == patch.x:
-                                macro_tile_idx = self.get_macro_patch_tile(patch.i)
-                macro_tile_idxs.append(macro_tile_idx)
-                macro_tile = self.world.get_macro_tile(macro_tile_idx)
-                for j in range(2):
-                    row[j][i * 2] = macro_tile[0 + 2 * j]
-                    row[j][i * 2 + 1] = macro_tile[1 + 2 * j]
-                    row[j][0x10 - i *2 - 1] = self.world.mirror_tile(row[j][i * 2])
-                    row[j][0x10 - i *2 - 2] = self.world.mirror_tile(row[j][i * 2 + 1])
+            row_macro_tile_idxs = list(lmr.macro_tiles)
+            if hardmode:
+                for i in range(4):
+                    if (y, i) in patch_index:
+                        row_macro_tile_idxs[i] = self.get_macro_patch_tile(patch_index[(y, i)])
+            macro_tiles = tuple(tuple(self.world.get_macro_tile(idx)) for idx in row_macro_tile_idxs)
+            unitiles = (tuple(unitile_rows.get(2 * y + 1, ())), tuple(unitile_rows.get(2 * y, ())))
+            signature = (macro_tiles, lmr.seam, unitiles, mirror)
             
-            for j in range(2):
-                # seam shift
-                row[j] = rotated(row[j], (0x10 - lmr.seam) % 0x10)
-                
-                # apply unitile data
-                if self.data.mapper_extension:
-                    x = -1
-                    for h in unitile_rows[2 * y + 1 - j]:
-                        x += 1
-                        u = h[unitile_j]
-                        if u is not None:
-                            row[j][x] = u.med_tile_idx
+            cached = cache.get(y)
+            if cached is None or cached[0] != signature:
+                cached = (signature, self.produce_med_tile_row(macro_tiles, lmr.seam, unitiles, mirror))
+                cache[y] = cached
             
-            rows.append(row[1])
-            rows.append(row[0])
+            macro_tile_idxs += row_macro_tile_idxs
+            rows += cached[1]
             
         return rows, macro_tile_idxs
+    
+    # returns the two med-tile rows (top, bottom) for one macro row.
+    def produce_med_tile_row(self, macro_tiles, seam, unitiles, mirror):
+        row = [[0] * 16, [0] * 16]
+        for i in range(4):
+            macro_tile = macro_tiles[i]
+            for j in range(2):
+                row[j][i * 2] = macro_tile[0 + 2 * j]
+                row[j][i * 2 + 1] = macro_tile[1 + 2 * j]
+                row[j][0x10 - i *2 - 1] = mirror[macro_tile[0 + 2 * j]]
+                row[j][0x10 - i *2 - 2] = mirror[macro_tile[1 + 2 * j]]
+        
+        for j in range(2):
+            # seam shift
+            row[j] = rotated(row[j], (0x10 - seam) % 0x10)
+            
+            # apply unitile data
+            for x, med_tile_idx in unitiles[j]:
+                row[j][x] = med_tile_idx
+        
+        return row[1], row[0]
 
 class World:
     def __init__(self, data, idx):
@@ -812,6 +970,10 @@ class World:
         self.total_length = None
         self.max_symmetry_idx = 0
         self.palettes = []
+        
+        # mirror_tile() for every med-tile index; see get_mirror_table()
+        self.mirror_table = None
+        self.mirror_table_signature = None
     
     def serialize_json(self):
         return {
@@ -839,7 +1001,35 @@ class World:
                 return False
         return True
         
+    # size of the world's data in rom, starting at self.ram
+    def length_bytes(self):
+        return 2 + 4 * len(self.med_tiles) + (len(self.med_tiles) + constants.global_med_tiles_count + 3) // 4 + 4 * len(self.macro_tiles) + 18
+    
+    def commit_signature(self):
+        return (
+            self.ram,
+            self.max_symmetry_idx,
+            tuple(tuple(t) for t in self.med_tiles),
+            tuple(self.med_tile_palettes),
+            tuple(tuple(t) for t in self.macro_tiles),
+            tuple(tuple(p) for p in self.palettes)
+        )
+        
+    # returns a 256-entry list, mirror_table[t] == mirror_tile(t).
+    # rebuilt only when the mirror pairs or max symmetry index have changed.
+    def get_mirror_table(self):
+        signature = (self.max_symmetry_idx, tuple(tuple(pair) for pair in self.data.mirror_pairs))
+        if self.mirror_table_signature != signature:
+            self.mirror_table = [self.compute_mirror_tile(t) for t in range(0x100)]
+            self.mirror_table_signature = signature
+        return self.mirror_table
+    
     def mirror_tile(self, t):
+        if t in range(0x100):
+            return self.get_mirror_table()[t]
+        return self.compute_mirror_tile(t)
+    
+    def compute_mirror_tile(self, t):
         if t == 0x11:
             return 0x0
         if t < 0x1e or t >= self.max_symmetry_idx:
@@ -1130,6 +1320,14 @@ class Music:
         raise Exception(f"Unable to resolve label: {arg}")
         return 0
     
+    def commit_signature(self):
+        return (
+            tuple(self.song_tempos),
+            tuple(tuple(entries) for entries in self.song_channel_entries),
+            tuple((name, label.addr) for name, label in self.label_to_addr.items()),
+            tuple((op.op, tuple(op.args), tuple(op.argtypes)) for op in self.code)
+        )
+    
     # TODO: optimize this with a datastructure..?
     def get_labels(self, addr):
         labels = []
@@ -1251,79 +1449,168 @@ class TitleScreen:
         self.palette_idxs = []
         self.ptr_offset_z = 8
         self.ptr_count_z = 5
+        
+        # (key, tokens, bit count) of the last compression
+        self.compressed_cache = None
+    
+    def commit_signature(self):
+        return (
+            self.ptr_offset_z,
+            self.ptr_count_z,
+            tuple(tuple(t) for t in self.table),
+            tuple(tuple(p) for p in self.palette_idxs)
+        )
     
+    # size in bytes of the compressed data, as used by the editor's usage bar.
+    # does not write to data.
+    # FIXME: not sure why adding 4 is necessary...
     def size(self):
-        # hacky implementation
-        # writes to data and then checks the bitstream.
-        # FIXME: not sure why adding 4 is necessary...
-        return self.write()[1] - self.data.ram_to_rom(constants.ram_range_title_screen[0]) + 4
+        tokens, bits = self.get_compressed()
+        return (bits + 7) // 8 + 4
     
-    def write(self):
-        bs = BitStream(self.data.bin, self.data.ram_to_rom(constants.ram_range_title_screen[0]))
-        table = self.table[0] + self.palette_idxs[0] + self.table[1] + self.palette_idxs[1]
+    # the sequence that is compressed into the title screen range
+    def get_uncompressed(self):
+        return bytes(v & 0xff for v in self.table[0] + self.palette_idxs[0] + self.table[1] + self.palette_idxs[1])
+    
+    # returns [(start, length)] giving, for each index i, the longest earlier match
+    # in the window (the earliest one on ties), or (0, 0) if none has length >= 2.
+    # candidates are found via hash chains on the next two bytes.
+    def find_matches(self, t):
+        window = 1 << self.ptr_offset_z
+        maxlen = 1 << self.ptr_count_z
+        chains = dict()
+        matches = []
+        for i in range(len(t)):
+            best = (0, 0)
+            limit = min(len(t) - i, maxlen)
+            if limit >= 2:
+                key = t[i:i + 2]
+                chain = chains.get(key)
+                if chain is None:
+                    chain = []
+                    chains[key] = chain
+                for j in chain[bisect.bisect_left(chain, i - window):]:
+                    l = best[1]
+                    if l >= limit:
+                        break
+                    # only examine candidates which beat the best so far
+                    if t[j:j + l + 1] == t[i:i + l + 1]:
+                        l += 1
+                        while l < limit and t[j + l] == t[i + l]:
+                            l += 1
+                        best = (j, l)
+                chain.append(i)
+            matches.append(best)
+        return matches
+    
+    # returns the compressed sequence as a list of (value, bit count) tokens.
+    # optimal: minimize the total bit count; otherwise use the (faster) greedy parse.
+    def compress(self, optimal=False):
+        t = self.get_uncompressed()
+        n = len(t)
+        matches = self.find_matches(t)
+        ref_bits = 2 + self.ptr_count_z + self.ptr_offset_z
+        
+        def zero():
+            return (0, 1)
+        
+        def literal(b):
+            return ((0b10 << 8) | b, 10)
+        
+        def reference(i, start, length):
+            return ((((0b11 << self.ptr_offset_z) | (i - start - 1)) << self.ptr_count_z) | (length - 1), ref_bits)
+        
+        tokens = []
+        if optimal:
+            # cost[i] is the fewest bits needed to encode t[i:]
+            cost = [0] * (n + 1)
+            choice = [None] * (n + 1)
+            for i in reversed(range(n)):
+                cost[i] = cost[i + 1] + (1 if t[i] == 0 else 10)
+                choice[i] = 1
+                start, length = matches[i]
+                for l in range(2, length + 1):
+                    if cost[i + l] + ref_bits < cost[i]:
+                        cost[i] = cost[i + l] + ref_bits
+                        choice[i] = l
+            i = 0
+            while i < n:
+                if choice[i] > 1:
+                    tokens.append(reference(i, matches[i][0], choice[i]))
+                elif t[i] == 0:
+                    tokens.append(zero())
+                else:
+                    tokens.append(literal(t[i]))
+                i += choice[i]
+            return tokens
         
-        # Lempel-Ziv compression, more or less
+        # length of the run of zeros starting at each index
+        zeros = [0] * (n + 1)
+        for i in reversed(range(n)):
+            zeros[i] = zeros[i + 1] + 1 if t[i] == 0 else 0
         
-        # TODO: this can be optimized further.
+        # Lempel-Ziv compression, more or less
         i = 0
-        while i < len(table):
-            # search for longest prefix
-            best_prefix = (0, 0) # (start, length)
-            for j in range(max(0, i - (1 << self.ptr_offset_z)), i):
-                assert(j < i)
-                l = common_prefix_length(table[i:], table[j:], min(len(table) - i, (1 << self.ptr_count_z)))
-                if l > best_prefix[1]:
-                    best_prefix = (j, l)
-            
-            # discard if too short
-            # 1 is always too short, because it could be done as a new byte instead (8 bits)
-            if best_prefix[1] <= 1:
-                best_prefix = (0, 0)
+        while i < n:
+            best_prefix = matches[i]
             
             # consider discarding if enough zeros to not make it worth it...
-            if best_prefix[1] <= 2 + self.ptr_count_z + self.ptr_offset_z:
+            if best_prefix[1] <= ref_bits:
                 altsize = 0
-                for t in table[best_prefix[0]:best_prefix[0] + best_prefix[1]]:
-                    altsize += (1 if t == 0 else 8)
-                if altsize <= 2 + self.ptr_count_z + self.ptr_offset_z:
+                for b in t[best_prefix[0]:best_prefix[0] + best_prefix[1]]:
+                    altsize += (1 if b == 0 else 8)
+                if altsize <= ref_bits:
                     best_prefix = (0, 0)
             
             # how long is the following chain of zeros?
-            best_zeros = common_prefix_length(table[i:], [0] * 0x100, min(len(table) - i, 0x100))
+            best_zeros = min(zeros[i], 0x100)
             
             # which compression should we use for the following substring?
-            if best_zeros <= 2 + self.ptr_count_z + self.ptr_offset_z and best_zeros >= best_prefix[1] and best_zeros > 0:
-                for j in range(best_zeros):
-                    bs.write_bit(0)
-                    i += 1
-            elif best_zeros > 2 + self.ptr_count_z + self.ptr_offset_z + 2 and best_zeros > best_prefix[1] and i > 0 and table[i - 1] != 0:
+            if best_zeros <= ref_bits and best_zeros >= best_prefix[1] and best_zeros > 0:
+                tokens += [zero()] * best_zeros
+                i += best_zeros
+            elif best_zeros > ref_bits + 2 and best_zeros > best_prefix[1] and i > 0 and t[i - 1] != 0:
                 # permits good RLE compression on next pass.
-                bs.write_bit(0)
+                tokens.append(zero())
                 i += 1
             elif best_prefix[1] > 1:
-                # write reference
-                bs.write_bit(1)
-                bs.write_bit(1)
-                
-                # location difference
-                bs.write_bits(i - best_prefix[0] - 1, self.ptr_offset_z)
-                
-                # length
-                bs.write_bits(best_prefix[1] - 1, self.ptr_count_z)
-                
+                tokens.append(reference(i, best_prefix[0], best_prefix[1]))
                 i += best_prefix[1]
             else:
-                # write literal byte
-                bs.write_bit(1)
-                bs.write_bit(0)
-                bs.write_bits(table[i], 8)
+                tokens.append(literal(t[i]))
                 i += 1
+        return tokens
+    
+    # returns (tokens, bit count) as written by write().
+    # memoized on the compressed contents, so repeated calls are cheap.
+    # optimal: True/False to force a parse; by default the greedy parse is used
+    # unless it does not fit in the range, in which case the optimal parse is used.
+    def get_compressed(self, optimal=None):
+        key = (self.ptr_offset_z, self.ptr_count_z, optimal, self.get_uncompressed())
+        if self.compressed_cache is None or self.compressed_cache[0] != key:
+            start, end = [self.data.ram_to_rom(addr) for addr in constants.ram_range_title_screen]
+            tokens = self.compress(optimal is True)
+            bits = sum(n for value, n in tokens)
+            if optimal is None and start + bits / 8 > end:
+                tokens = self.compress(True)
+                bits = sum(n for value, n in tokens)
+            self.compressed_cache = (key, tokens, bits)
+        return self.compressed_cache[1], self.compressed_cache[2]
+    
+    def write(self, optimal=None):
+        start, end = [self.data.ram_to_rom(addr) for addr in constants.ram_range_title_screen]
+        tokens, bits = self.get_compressed(optimal)
+        
+        acc = BitAccumulator()
+        for value, n in tokens:
+            acc.push(value, n)
+        acc.splice(self.data.bin, start)
         
         # bounds check
-        if bs.offset + (bs.bitoffset / 8) > self.data.ram_to_rom(constants.ram_range_title_screen[1]):
-            self.data.errors += ["screen data exceeds range (" + HX(math.ceil(bs.offset + (bs.bitoffset / 8))) + " > " + HX(self.data.ram_to_rom(constants.ram_range_title_screen[1])) + ")" ]
-            return False, math.ceil(bs.offset + (bs.bitoffset / 8))
-        return True, math.ceil(bs.offset + (bs.bitoffset / 8))
+        if start + (acc.length_bits() / 8) > end:
+            self.data.errors += ["screen data exceeds range (" + HX(start + acc.length_bytes()) + " > " + HX(end) + ")" ]
+            return False, start + acc.length_bytes()
+        return True, start + acc.length_bytes()
     
     def get_tile(self, x, y, k=0):
         idx = x + y * 32
@@ -1421,16 +1708,37 @@ class TextData:
         self.range = ramrange or constants.ram_range_text
         self.chunk = chunk
     
+    def commit_signature(self):
+        return (self.table, tuple(self.text), self.data.mapper_extension)
+    
+    # returns a dict from symbol to (code, bit count)
+    def get_codes(self):
+        codes = {" ": (0, 5), "%": (3, 5), "\n": (3, 5)}
+        for i, t in enumerate(self.table):
+            if t in codes:
+                continue
+            if i <= 0x1b:
+                # common character
+                assert(i + 4 < 0x20)
+                codes[t] = (i + 4, 5)
+            else:
+                # extended character
+                assert(i - 0x1a < 0x13)
+                codes[t] = ((2 << 5) | (i - 0x1a), 10)
+        return codes
+    
     def read(self):
+        start = self.data.ram_to_rom(self.range[0], self.chunk)
+        bs = BitStream(self.data.bin, start)
+        self.text = []
+        
+        # skip to first marker
+        while bs.read_bits(5) != 1:
+            pass
+        
+        # each string runs up to the next marker
         for i in range(29):
-            bs = BitStream(self.data.bin, self.data.ram_to_rom(self.range[0], self.chunk))
             text = ""
-            # skip to marker
-            for j in range(i + 1):
-                while bs.read_bits(5) != 1:
-                    pass
-            
-            # read text
             while True:
                 b = bs.read_bits(5)
                 if b == 0:
@@ -1447,71 +1755,78 @@ class TextData:
                     text += "%"
                 else:
                     text += self.table[b - 4]
-        
+    
+    # returns the encoded symbols of the given text (without its marker) as a BitAccumulator,
+    # or None on error.
+    # diacritics: list of diacritics assigned so far; new ones are appended.
+    def encode(self, text, codes, diacritics):
+        acc = BitAccumulator()
+        j = -1
+        while True:
+            j = j + 1
+            if j >= len(text):
+                break
+            t = text[j]
+            if t == "\\":
+                # escape characters
+                if text[j + 1] == "\\":
+                    j = j + 1
+                elif text[j + 1] == "d":
+                    t = text[j+1:j+4]
+                    j = j + 3
+            if t in codes:
+                acc.push(*codes[t])
+            elif len(t) == 3 and t[0] == "d":
+                if self.data.mapper_extension:
+                    diacritic = int(t[1:], 16)
+                    if diacritic not in diacritics:
+                        diacritics.append(diacritic)
+                        if len(diacritics) > src.mappermages.diacritics_table_range[1] - src.mappermages.diacritics_table_range[0]:
+                            self.data.errors += ["Too many unique diacritics. Please use fewer types of diacritics."]
+                            return None
+                    # extended character: diacritic.
+                    acc.push(2, 5)
+                    acc.push(0x13 + diacritics.index(diacritic), 5)
+                else:
+                    self.data.errors += ["Invalid text symbol: \"" + t + "\"\nTo enable diacritics, please set the mapper_extension mod to true."]
+                    return None
+            else:
+                self.data.errors += ["Invalid text symbol: \"" + t + "\"\nTo add new symbols, please export images, edit chr-rom, then reimport chr-rom."]
+                return None
+        return acc
+    
     def write(self):
-        bs = BitStream(self.data.bin, self.data.ram_to_rom(self.range[0], self.chunk))
-        unique_diacritics = []
+        start = self.data.ram_to_rom(self.range[0], self.chunk)
+        codes = self.get_codes()
+        diacritics = []
+        acc = BitAccumulator()
         for text in self.text:
             # start-of-text marker
-            bs.write_bits(1, 5)
-            
-            j = -1
-            while True:
-                j = j + 1
-                if j >= len(text):
-                    break
-                t = text[j]
-                if t == " ":
-                    bs.write_bits(0, 5)
-                elif t == "%" or t == "\n":
-                    bs.write_bits(3, 5)
-                else:
-                    if t == "\\":
-                        # escape characters
-                        if text[j + 1] == "\\":
-                            j = j + 1
-                        elif text[j + 1] == "d":
-                            t = text[j+1:j+4]
-                            j = j + 3
-                    if t in self.table:
-                        i = self.table.index(t)
-                        if i <= 0x1b:
-                            # common character
-                            assert(i + 4 < 0x20)
-                            bs.write_bits(i + 4, 5)
-                        else:
-                            # extended character
-                            bs.write_bits(2, 5)
-                            assert(i - 0x1a < 0x13)
-                            bs.write_bits(i - 0x1a, 5)
-                    elif len(t) == 3 and t[0] == "d":
-                        if self.data.mapper_extension:
-                            diacritic = int(t[1:], 16)
-                            if diacritic not in unique_diacritics:
-                                unique_diacritics.append(diacritic)
-                                if len(unique_diacritics) > src.mappermages.diacritics_table_range[1] - src.mappermages.diacritics_table_range[0]:
-                                    self.data.errors += ["Too many unique diacritics. Please use fewer types of diacritics."]
-                                    return False, None
-                                addr = src.mappermages.diacritics_table_range[0] + len(unique_diacritics) - 1
-                                self.data.write_byte(self.data.ram_to_rom(addr), diacritic)
-                            # extended character: diacritic.
-                            bs.write_bits(2, 5)
-                            outb = 0x13 + unique_diacritics.index(diacritic)
-                            bs.write_bits(outb, 5)
-                        else:
-                            self.data.errors += ["Invalid text symbol: \"" + t + "\"\nTo enable diacritics, please set the mapper_extension mod to true."]
-                            return False, None
-                    else:
-                        self.data.errors += ["Invalid text symbol: \"" + t + "\"\nTo add new symbols, please export images, edit chr-rom, then reimport chr-rom."]
-                        return False, None
+            acc.push(1, 5)
             
+            encoded = self.encode(text, codes, diacritics)
+            if encoded is None:
+                return False, None
+            acc.push(encoded.value, encoded.nbits)
+        
+        for i, diacritic in enumerate(diacritics):
+            self.data.write_byte(self.data.ram_to_rom(src.mappermages.diacritics_table_range[0] + i), diacritic)
+        
         # bounds check
-        bs_end = bs.offset + (bs.bitoffset / 8)
+        bs_end = start + (acc.length_bits() / 8)
         if bs_end > self.data.ram_to_rom(self.range[1], self.chunk):
             self.data.errors += ["text section exceeds range (" + HX(math.ceil(bs_end)) + " > " + HX(self.data.ram_to_rom(constants.ram_range_text[1])) + ")" ]
             return False, None
+        acc.splice(self.data.bin, start)
         return True, self.data.rom_to_ram(int(math.ceil(bs_end)), self.chunk)
-            
+    
+# an immutable committed ROM image, along with the base ROM it was built from.
+class BuiltImage:
+    def __init__(self, orgbin, bin, mapper_extension):
+        self.orgbin = bytes(orgbin)
+        self.bin = bytes(bin)
+        self.mapper_extension = mapper_extension
+
 class MMData:
     # convert ram address to rom address
     def ram_to_rom(self, address, chunk=""):
@@ -1597,50 +1912,21 @@ class MMData:
                 s += "\n  - " + err;
             return s;
 
-    # read chr data at offet into an array
-    def chr_to_array(data, chr_ram):
-        arr = [[0 for x in range(8)] for y in range(8)]
-        for y in range(8):
-            l = data.read_byte(data.chr_to_rom(chr_ram + y))
-            u = data.read_byte(data.chr_to_rom(chr_ram + y + 8))
-            for x in range(8):
-                bl = (l >> (7 - x)) & 0x1
-                bu = (u >> (7 - x)) & 0x1
-                arr[y][x] = (bu << 1) | (bl)
-        return arr
-
-    # write chr data from array at offset
-    def array_to_chr(data, chr_ram, arr):
-        for k in range(2):
-            for y in range(8):
-                a = data.chr_to_rom(chr_ram + y + 8*k)
-                v = 0
-                for x in range(8):
-                    b = (arr[y][x] >> k) & 1
-                    v <<= 1
-                    v |= b
-                data.write_byte(a, v)
-    
     def set_chr_from_bin(self):
         # array indices:
         # chr[page][image][y][x]
-        self.chr = [
-            [
-                self.chr_to_array(b * 0x1000 + img * 0x10)
-                for img in range(0x100)
-            ] for b in range(2)
-        ]
+        start = self.chr_to_rom(0)
+        self.chr = src.chrstore.decode(self.bin[start:start + 0x2000])
     
     def store_chr_in_bin(self):
-        for b, page in enumerate(self.chr):
-            for i, img in enumerate(page):
-                self.array_to_chr(b * 0x1000 + i * 0x10, img)
+        start = self.chr_to_rom(0)
+        self.bin[start:start + 0x2000] = src.chrstore.encode(self.chr)
 
     def chr_row_to_short(self, row):
         num = 0
         for pix in row:
             num <<= 2
-            num |= pix
+            num |= int(pix)
         return num
 
     def chr_short_to_row(self, short):
@@ -1658,6 +1944,8 @@ class MMData:
         with open(file, "rb") as f:
             self.orgbin = f.read()
             self.bin = bytearray(self.orgbin)
+            self.commit_cache = None
+            self.asm_cache = None
             
             # check length
             if len(self.bin) < 0xa010:
@@ -1680,6 +1968,11 @@ class MMData:
                 self.errors += ["NES file must be exactly 0xa010 in size. (Mapper changes can be applied by " + constants.mmname + ", but cannot be read.)"]
                 return False
             
+            # skip decoding if this ROM has been decoded before
+            if self.load_decode_cache(hashval):
+                return True
+            errors_before_decode = len(self.errors)
+            
             self.levels = []
             self.spawnable_objects = []
             self.macro_tiles = [] # array of [tl, tr, bl, br]
@@ -1816,11 +2109,61 @@ class MMData:
 ;   db #15
 ; max $C010 ; ensure code does not exceed patch region 
 """
-                
+            
+            self.save_decode_cache(hashval, self.errors[errors_before_decode:])
             return True
         self.errors += ["Failed to open file \"" + file + "\" for reading."]
         return False
         
+    def decode_cache_path(self, hashval):
+        if decode_cache_dir is None or hashval not in constants.base_hashes:
+            return None
+        return os.path.join(decode_cache_dir, hashval + "-" + decode_cache_fingerprint() + ".pickle")
+    
+    # restores the decoded model from the cache; returns False if not cached.
+    def load_decode_cache(self, hashval):
+        path = self.decode_cache_path(hashval)
+        if path is None or not os.path.exists(path):
+            return False
+        try:
+            with open(path, "rb") as f:
+                snapshot = f.read()
+            model = DecodeCacheUnpickler(io.BytesIO(snapshot), self).load()
+        except Exception:
+            # damaged; decode normally (and replace it.)
+            return False
+        if type(model) != dict or "errors" not in model:
+            return False
+        errors = model.pop("errors")
+        self.__dict__.update(model)
+        self.errors += errors
+        return True
+    
+    # saves the just-decoded model (and any warnings from decoding it) to the cache,
+    # replacing any cache of the same ROM from other versions of the code.
+    # failure is not an error, but is reported.
+    def save_decode_cache(self, hashval, errors):
+        path = self.decode_cache_path(hashval)
+        if path is None:
+            return
+        model = {key: value for key, value in self.__dict__.items() if key not in decode_cache_exclude}
+        model["errors"] = errors
+        try:
+            out = io.BytesIO()
+            DecodeCachePickler(out, self).dump(model)
+            os.makedirs(decode_cache_dir, exist_ok=True)
+            # write then rename, so that concurrent readers never see a partial file.
+            tmp = path + "." + str(os.getpid())
+            with open(tmp, "wb") as f:
+                f.write(out.getvalue())
+            os.replace(tmp, path)
+            
+            for file in os.listdir(decode_cache_dir):
+                if file.startswith(hashval + "-") and file.endswith(".pickle") and file != os.path.basename(path):
+                    os.remove(os.path.join(decode_cache_dir, file))
+        except Exception as e:
+            print("Warning: unable to save decode cache \"" + path + "\": " + str(e), file=sys.stderr)
+    
     def write_passwords(self):
         pwaddr = self.ram_to_rom(constants.ram_range_passwords[0])
         for password in self.passwords:
@@ -2034,20 +2377,8 @@ class MMData:
             self.write_word(addr, constants.ram_ending_dispatch)
             addr += 2
     
-    # edits the binary data to be in line with everything else
-    # required before writing to a binary file.
-    def commit(self):
-        # restore bin to original.
-        self.bin = bytearray(self.orgbin)
-
-        # possibly add extra banks
-        if self.mapper_extension:
-            print("mapper extension...")
-            self.commit_bank_extension()
-        
-        # write CHR
-        self.store_chr_in_bin()
-        
+    # writes the data that is not tracked per-section (small, fixed-location tables).
+    def commit_globals(self):
         # write number of lives
         self.write_byte(self.ram_to_rom(constants.ram_default_lives), self.default_lives)
         
@@ -2104,11 +2435,10 @@ class MMData:
         for i in range(constants.global_macro_tiles_count):
             for j in range(4):
                 self.write_byte(self.ram_to_rom(macro_corner_ptrs[j] + i), self.macro_tiles[i][j])
-        
-        # write worlds
-        for world in self.worlds:
-            world.commit()
-            
+
+    # writes stage names, levels, unitiles, and object drops.
+    # returns the rom ranges written, or None on error.
+    def commit_levels(self):
         # write mapper extension text
         mapper_extension_level_start = 0x8000
         if self.mapper_extension and len(self.stagenames.text) > 0:
@@ -2116,7 +2446,7 @@ class MMData:
                 self.stagenames.text += [""]
             success, mapper_extension_level_start = self.stagenames.write()
             if not success:
-                return False
+                return None
             else:
                 self.write_word(self.ram_to_rom(src.mappermages.extended_text_ptr), 0x8000)
             
@@ -2127,7 +2457,7 @@ class MMData:
             # write level data
             result, level_ram_location = level.commit(level_ram_location)
             if not result:
-                return False
+                return None
             
             # optional unitile extension
             if self.mapper_extension and level.level_idx < constants.level_count:
@@ -2135,41 +2465,36 @@ class MMData:
                 
                 if not result:
                     self.errors += ["Failed to write unitile data."]
-                    return False
+                    return None
                 
                 result, unitile_location = level.commit_drop_objects(unitile_location)
                 
                 if not result:
                     self.errors += ["Failed to write object drop data."]
-                    return False
+                    return None
             
         # level bounds check
         ram_level_end = 0xC000 if self.mapper_extension else constants.ram_range_levels[1]
         if level_ram_location > ram_level_end:
             self.errors += ["level space exceeded (" + HX(level_ram_location) + " > " + HX(ram_level_end) + ")"]
-            return False
+            return None
         
         if self.mapper_extension:
             if unitile_location > src.mappermages.unitile_table_range[1]:
                 self.errors += ["unitile (med-tile patch) space exceeded (" + HX(unitile_location) + " > " + HX(src.mappermages.unitile_table_range[1]) + ")"]
-                return False
-        
-        # write music
-        if not self.music.commit():
-            return False
-            
-        # write title screen
-        if not self.title_screen.write():
-            return False
+                return None
         
-        # write text
-        if not self.text.write()[0]:
-            return False
-            
-        # write passwords:
-        if not self.write_passwords():
-            return False
-                
+        if self.mapper_extension:
+            return [
+                (self.ram_to_rom(0x8000, "level"), self.ram_to_rom(level_ram_location, "level")),
+                (self.ram_to_rom(src.mappermages.unitile_table_range[0]), self.ram_to_rom(unitile_location)),
+                (self.ram_to_rom(src.mappermages.diacritics_table_range[0]), self.ram_to_rom(src.mappermages.diacritics_table_range[1])),
+                (self.ram_to_rom(src.mappermages.extended_text_ptr), self.ram_to_rom(src.mappermages.extended_text_ptr) + 2)
+            ]
+        return [(self.ram_to_rom(constants.ram_range_levels[0]), self.ram_to_rom(level_ram_location))]
+    
+    # patches applied over the encoded data: mods, user patches, asm, and quickstart.
+    def commit_overlays(self):
         # patches over
         if self.mods["no_bounce"]:
             self.write_patch(
@@ -2235,55 +2560,202 @@ class MMData:
             addr = patch.addr if patch.is_rom else self.ram_to_rom(patch.addr)
             self.write_patch(addr, patch.data)
         
-        # asm patch
-        try:
-            asmpatch = src.asm6502.assemble(self.asm)
-        except src.asm6502.AsmException as e:
-            if hasattr(e, "message"):
-                self.errors += [e.message]
-            else:
-                self.errors += [f"{e}"]
-            return False
-        for chunk in asmpatch:
+        # asm patch (reassembled only if the source has changed)
+        asm_hash = hashlib.md5(self.asm.encode("utf-8")).digest()
+        if self.asm_cache is None or self.asm_cache[0] != asm_hash:
+            try:
+                self.asm_cache = (asm_hash, src.asm6502.assemble(self.asm))
+            except src.asm6502.AsmException as e:
+                if hasattr(e, "message"):
+                    self.errors += [e.message]
+                else:
+                    self.errors += [f"{e}"]
+                return False
+        for chunk in self.asm_cache[1]:
             romaddr = self.ram_to_rom(chunk["addr"])
             self.write_patch(romaddr, chunk["data"])
         
         self.write_quickstart_patch()
         
         return True
+    
+    # rewrites one tracked section of the ROM image if its signature has changed
+    # since the cached image was produced.
+    # write() should return (success, [rom ranges written]).
+    def commit_section(self, name, signature, write):
+        cache = self.commit_cache
+        if name in cache["signatures"] and cache["signatures"][name] == signature:
+            return True
         
-    def write(self, file):
-        self.errors = []
+        # undo whatever this section wrote last time
+        for start, end in cache["footprints"].get(name, []):
+            self.bin[start:end] = cache["base"][start:end]
+        cache["signatures"].pop(name, None)
+        
+        result, footprint = write()
+        cache["footprints"][name] = footprint
+        if result:
+            cache["signatures"][name] = signature
+        return result
+    
+    # edits the binary data to be in line with everything else
+    # required before writing to a binary file.
+    # only the sections changed since the previous commit are re-encoded.
+    def commit(self):
+        layout = (self.mapper_extension, len(self.orgbin))
+        cache = self.commit_cache
+        
+        # the cache is only restored if this commit succeeds.
+        self.commit_cache = None
+        
+        if cache is None or cache["layout"] != layout:
+            # restore bin to original.
+            self.bin = bytearray(self.orgbin)
+
+            # possibly add extra banks
+            if self.mapper_extension:
+                print("mapper extension...")
+                self.commit_bank_extension()
+            
+            cache = {
+                "layout": layout,
+                "base": bytes(self.bin),
+                "image": bytes(self.bin),
+                "signatures": dict(),
+                "footprints": dict()
+            }
+        
+        self.commit_cache = cache
         try:
-            if not self.commit():
+            self.bin = bytearray(cache["image"])
+            if not self.commit_tracked():
+                cache = None
                 return False
-            with open(file, "wb") as nes:
-                nes.write(self.bin)
-                return True
-            self.errors += ["Failed to open file \"" + file + "\" for writing."]
-            return False
+            cache["image"] = bytes(self.bin)
         finally:
-            # restore bin to original.
-            self.bin = bytearray(self.orgbin)
+            self.commit_cache = cache
         
-    def write_ips(self, file):
-        self.errors = []
+        return self.commit_overlays()
+    
+    def commit_tracked(self):
+        # write CHR
+        for b, page in enumerate(self.chr):
+            def write_chr_page():
+                start, end = self.chr_to_rom(b * 0x1000), self.chr_to_rom((b + 1) * 0x1000)
+                self.bin[start:end] = src.chrstore.encode(page)
+                return True, [(start, end)]
+            if not self.commit_section(("chr", b), src.chrstore.signature(page), write_chr_page):
+                return False
+        
+        self.commit_globals()
+        
+        # write worlds
+        for world in self.worlds:
+            def write_world():
+                start = self.ram_to_rom(world.ram)
+                return world.commit(), [(start, start + world.length_bytes())]
+            if not self.commit_section(("world", world.idx), world.commit_signature(), write_world):
+                return False
+        
+        # write levels
         if self.mapper_extension:
-            self.errors += ["IPS is not available when mapper-extension is enabled."]
+            for level in self.levels:
+                level.combine_unitiles_by_difficulty()
+        levels_signature = (
+            tuple(level.commit_signature() for level in self.levels),
+            tuple(self.stagenames.text) if self.mapper_extension else None,
+            
+            # stage names and text share the diacritics table
+            self.text.commit_signature() if self.mapper_extension else None
+        )
+        def write_levels():
+            footprint = self.commit_levels()
+            if footprint is None:
+                return False, []
+            
+            # text must be rewritten after the diacritics table is.
+            self.commit_cache["signatures"].pop("text", None)
+            return True, footprint
+        if not self.commit_section("levels", levels_signature, write_levels):
+            return False
+        
+        # write music
+        def write_music():
+            footprint = [(self.ram_to_rom(constants.ram_range_music[0]), self.ram_to_rom(constants.ram_range_music[1]))]
+            return self.music.commit(), footprint
+        if not self.commit_section("music", self.music.commit_signature(), write_music):
+            return False
+            
+        # write title screen
+        def write_title_screen():
+            result, end = self.title_screen.write()
+            start, range_end = [self.ram_to_rom(addr) for addr in constants.ram_range_title_screen]
+            return result, [(start, max(end, range_end))]
+        if not self.commit_section("title", self.title_screen.commit_signature(), write_title_screen):
+            return False
+        
+        # write text
+        def write_text():
+            footprint = [(self.ram_to_rom(self.text.range[0], self.text.chunk), self.ram_to_rom(self.text.range[1], self.text.chunk))]
+            return self.text.write()[0], footprint
+        if not self.commit_section("text", self.text.commit_signature(), write_text):
             return False
+            
+        # write passwords:
+        if not self.write_passwords():
+            return False
+        
+        return True
+        
+    # commits the model and returns the result, or None on error.
+    # the result can be passed to write(), write_ips(), write_bps(), and stat()
+    # so that several outputs share a single commit.
+    def build(self):
         if not self.commit():
+            return None
+        return BuiltImage(self.orgbin, self.bin, self.mapper_extension)
+        
+    def write(self, file, image=None):
+        if image is None:
+            self.errors = []
+            try:
+                image = self.build()
+            finally:
+                # restore bin to original.
+                self.bin = bytearray(self.orgbin)
+            if image is None:
+                return False
+        with open(file, "wb") as nes:
+            nes.write(image.bin)
+            return True
+        self.errors += ["Failed to open file \"" + file + "\" for writing."]
+        return False
+        
+    def write_ips(self, file, image=None):
+        if image is None:
+            self.errors = []
+        if (self.mapper_extension if image is None else image.mapper_extension):
+            self.errors += ["IPS is not available when mapper-extension is enabled."]
             return False
-        rval = src.ips.create_patch(self.orgbin, self.bin, file)
+        if image is None:
+            image = self.build()
+            if image is None:
+                return False
+        rval = src.ips.create_patch(image.orgbin, image.bin, file)
         if not rval:
             self.errors += ["Failed to export IPS patch."]
         return rval
 
-    def write_bps(self, file):
-        self.errors = []
-        if not self.commit():
-            return False
+    def write_bps(self, file, image=None):
+        if image is None:
+            self.errors = []
+            image = self.build()
+            if image is None:
+                return False
         try:
-            src.bps.create_patch(self.orgbin, self.bin, file)
+            if not src.bps.create_patch(image.orgbin, image.bin, file):
+                self.errors += ["Failed to export BPS patch: verification failed."]
+                return False
         except Exception as e:
             self.errors += ["Failed to export BPS patch: " + str(e)]
             return False
@@ -2299,12 +2771,42 @@ class MMData:
         self.startscreen = False
         self.startflag = None
         self.startplayers = 1
+        self.commit_cache = None
+        self.asm_cache = None
         self.object_config = [
             [cfg(self, gid) for cfg in constants.object_data[gid]["config"]]
             for gid in range(len(constants.object_data))
         ]
         pass
         
+    # while cloning, the ROM buffers are left out of the pickled state;
+    # see clone(). (other pickles, e.g. for worker processes, are complete.)
+    def __getstate__(self):
+        state = self.__dict__
+        if getattr(cloning, "data", None) is self:
+            state = {key: value for key, value in state.items() if key not in clone_buffers}
+            if self.commit_cache is not None:
+                state["commit_cache"] = {key: value for key, value in self.commit_cache.items() if key not in clone_buffers}
+        return state
+    
+    # returns an independent copy of this model.
+    # (a pickle round-trip, which is several times faster than copy.deepcopy.)
+    # the immutable ROM data (the original rom and the commit cache's images) is
+    # never copied, but shared with the clone. the commit cache is carried
+    # over, so the clone's first build only re-encodes the sections it changed.
+    def clone(self):
+        cloning.data = self
+        try:
+            data = pickle.loads(pickle.dumps(self, protocol=pickle.HIGHEST_PROTOCOL))
+        finally:
+            cloning.data = None
+        data.orgbin = self.orgbin
+        data.bin = bytearray(self.bin)
+        if self.commit_cache is not None:
+            data.commit_cache["base"] = self.commit_cache["base"]
+            data.commit_cache["image"] = self.commit_cache["image"]
+        return data
+    
     def get_object_name(self, gid):
         str = ""
         if gid < len(constants.object_names):
@@ -2317,7 +2819,7 @@ class MMData:
         return "[" + ", ".join('"' + self.get_object_name(gid) + '"' for gid in spawnable) + "]"
         
     # write data to a human-readable hack.txt file
-    def stat(self, fname=None, oall=False):
+    def stat(self, fname=None, oall=False, image=None):
         out=print
         file = None        
         try:
@@ -2325,7 +2827,10 @@ class MMData:
                 file = open(fname, "w")
                 out = functools.partial(stat_out, file)
             
-            self.commit()
+            if image is None:
+                self.commit()
+            else:
+                self.bin = bytearray(image.bin)
 
             out("# Micro Mages Hack File")
             out()
@@ -2486,7 +2991,8 @@ class MMData:
                     s += HX(self.sprite_palettes[i][j + 1]) + " "
                 out(s)
 
-            if oall or self.is_dirty("chr"):
+            chr_dirty_tiles = self.chr_dirty_tiles()
+            if oall or any(chr_dirty_tiles):
                 out()
                 out("# chr-rom")
                 out("# This is the graphics data. Each line is an 8x8 tile or sprite,")
@@ -2499,7 +3005,7 @@ class MMData:
                         # nice and pretty and neat
                         out()
                     
-                    if oall or self.is_dirty("chr", chr_idx=i):
+                    if oall or chr_dirty_tiles[i]:
                         s = "CRB " if i < 0x100 else "CRS "
                         s += HB(i & 0xff) + ":"
                         for j in range(0x10):
@@ -2748,18 +3254,21 @@ class MMData:
                 return self.orgbin[address - src.mappermages.EXTENSION_LENGTH] != self.bin[address]
         return self.orgbin[address] != self.bin[address]
         
+    # returns a list of 0x200 bools, true for each chr tile which differs from the base rom.
+    # compares the chr data in bin, or the given chr data (e.g. src.chrstore.encode(self.chr)).
+    def chr_dirty_tiles(self, chr_bytes=None):
+        if chr_bytes is None:
+            start = self.chr_to_rom(0)
+            chr_bytes = self.bin[start:start + 0x2000]
+        start = 0x10 + 0x8000
+        return src.chrstore.changed_tiles(self.orgbin[start:start + 0x2000], chr_bytes)
+    
     def is_dirty(self, *args, **kwargs):
         if "chr" in kwargs or "chr" in args:
+            dirty = self.chr_dirty_tiles()
             if "chr_idx" in kwargs:
-                chr_idx = kwargs["chr_idx"]
-                for i in range(0x10):
-                    if self.byte_is_dirty(self.chr_to_rom(i + chr_idx * 0x10)):
-                        return True
-                return False
-            for i in range(0x200):
-                if self.is_dirty("chr", chr_idx=i):
-                    return True
-            return False
+                return dirty[kwargs["chr_idx"]]
+            return any(dirty)
             
     # read data from a human-readable hack.txt file
     def parse(self, file):
@@ -3181,6 +3690,9 @@ class MMData:
             
             # integrate CHR changes
             self.set_chr_from_bin()
+            
+            for level in self.levels:
+                level.invalidate()
 
             # correct title screen
             for k in range(2):
@@ -3289,7 +3801,13 @@ class MMData:
                 if len(c[0]) != len(self.chr[0]):
                     errors += ["chr page wrong length"]
                     return False
-                self.chr = c
+                self.chr = src.chrstore.from_lists([
+                    [
+                        [self.chr_short_to_row(short) for short in img]
+                        for img in page
+                    ]
+                    for page in c
+                ])
             elif key == "worlds-common":
                 d = j[key]
                 for key in d:
@@ -1320,6 +1320,7 @@ class Gui:
                     macro_row.macro_tiles = [0, 0, 0, 0]
                     macro_row.seam = 0
                 level.unitile_patches = []
+                level.invalidate()
                 
                 # lazy, but this is one way to refresh everything.
                 self.select_stage(self.stage_idx, self.hard)
@@ -1434,6 +1435,9 @@ Please remember to save frequently and make backups.
             self.subwindowctl(GuiScreenEditor, screen=action.screen)
 
         level = self.level
+        
+        if action.type in ["tile", "seam", "object", "patch", "unitile"]:
+            level.invalidate()
 
         if action.type == "tile":
             tile = action.prev_tile if undo else action.tile
@@ -3064,8 +3068,8 @@ Please remember to save frequently and make backups.
                 str += " "
                 
             # space remaining
-            ps_ = self.level.produce_patches_stream()
-            os_ = self.level.produce_objects_stream()
+            ps_ = self.level.get_patches_stream()
+            os_ = self.level.get_objects_stream()
             
             bits_used = int(ps_.length_bytes() * 8 + os_.length_bits())
             bytes_used = int((bits_used) / 8)
@@ -1,8 +1,16 @@
 # exports levels as images
 
 from src import constants
+from src import chrstore
 from src.util import *
 import os
+import json
+import hashlib
+import pickle
+import multiprocessing
+
+if chrstore.available:
+    import numpy
 
 available = True
 
@@ -13,34 +21,58 @@ except ImportError as e:
     raise e
 
 def chr_to_img(data, chrpage, chrimg, img, palette, offset=(0, 0), flipx=False, flipy=False, sprite=False, semi=False):
-    arr = data.chr[chrpage][chrimg]
-    for y in range(8):
-        for x in range(8):
-            
-            col_idx = arr[y][x]
-            col = palette[col_idx]
-            colrgb = constants.palette_rgb[col]
-            
-            # sprite transparency
-            if sprite:
-                colrgb = (colrgb[0], colrgb[1], colrgb[2], 0xff)
-                if col == 0xf:
-                    colrgb = (0, 0, 0, 0)
-                elif semi:
-                    colrgb = (colrgb[0], colrgb[1], min(0xff, colrgb[2] + 0x40), 0x50)
-            
-            img.putpixel((7 - x + offset[0] if flipx else x + offset[0], (7 - y if flipy else y) + offset[1]), colrgb)
+    arr = chrstore.tile(data.chr, chrpage, chrimg)
+    
+    # colour for each of the 4 colour indices
+    colours = []
+    for col_idx in range(4):
+        col = palette[col_idx]
+        colrgb = constants.palette_rgb[col]
+        
+        # sprite transparency
+        if sprite:
+            colrgb = (colrgb[0], colrgb[1], colrgb[2], 0xff)
+            if col == 0xf:
+                colrgb = (0, 0, 0, 0)
+            elif semi:
+                colrgb = (colrgb[0], colrgb[1], min(0xff, colrgb[2] + 0x40), 0x50)
+        elif img.mode == "RGBA":
+            colrgb = (colrgb[0], colrgb[1], colrgb[2], 0xff)
+        colours.append(colrgb)
+    
+    pixels = []
+    for y in (reversed(range(8)) if flipy else range(8)):
+        row = arr[y]
+        for x in (reversed(range(8)) if flipx else range(8)):
+            pixels.append(colours[row[x]])
+    
+    tile = Image.new(img.mode, (8, 8))
+    tile.putdata(pixels)
+    img.paste(tile, offset)
+
+# palette used for each chr page in the chr sheet
+chr_sheet_palettes = [constants.bg_palette, constants.sprite_palette]
 
 def produce_chr_sheet(data):
     img = Image.new('RGB', (256, 128))
     for b in range(2):
-        palette = [constants.bg_palette, constants.sprite_palette][b]
+        palette = chr_sheet_palettes[b]
         for y in range(16):
             for x in range(16):
                 chr_to_img(data, b, x + y * 0x10, img, palette, (x * 0x8 + b * 0x80, y * 0x8))
     return img
 
+# returns [gid] -> image of object (or None); cached per chr and sprite palettes.
 def produce_object_images(data, semi=False):
+    key = (
+        "objects",
+        semi,
+        tuple(tuple(palette) for palette in data.sprite_palettes),
+        chrstore.encode(data.chr)
+    )
+    return list(cached_render(key, lambda: render_object_images(data, semi)))
+
+def render_object_images(data, semi=False):
     object_images = []
     for object_data in constants.object_data:
         if "chr" in object_data:
@@ -82,73 +114,217 @@ def produce_object_images(data, semi=False):
     
     return object_images
 
-def set_chr_rom_from_image_path(data, path):
-    return set_chr_rom_from_image(data, Image.open(path))
+def set_chr_rom_from_image_path(data, path, mode="auto", rect=None):
+    return set_chr_rom_from_image(data, Image.open(path), mode, rect)
 
-def set_chr_rom_from_image(data, img):
+chr_import_modes = ["auto", "index", "nearest", "brightness"]
+
+# returns [(page, image)] for the tiles in the given rectangle of the chr sheet
+# rect: (x, y, w, h) in tiles, or None for the whole sheet.
+def chr_sheet_tiles(rect=None):
+    x0, y0, w, h = rect or (0, 0, 0x20, 0x10)
+    return [
+        (x // 0x10, y * 0x10 + x % 0x10)
+        for y in range(max(0, y0), min(0x10, y0 + h))
+        for x in range(max(0, x0), min(0x20, x0 + w))
+    ]
+
+# convert intensity to a 0-4 value, through a highly bespoke and stupid formula.
+def brightness_to_chr(pix):
+    v = float(pix[0] + pix[1] + pix[2]) / float(0x300)
+    if v < 0.1:
+        return 0
+    elif v < 0.24:
+        return 1
+    elif v < 0.7:
+        return 2
+    return 3
+
+def nearest_to_chr(pix, colours):
+    return min(range(4), key=lambda k: sum((pix[c] - colours[k][c]) ** 2 for c in range(3)))
+
+# sets chr data from an image laid out like the chr sheet (see produce_chr_sheet).
+# mode selects how pixels are converted to 2-bit colours:
+#   "index": the image has a palette, and each pixel's palette index is its colour.
+#   "nearest": the colour of the sheet's palette (as exported) nearest to the pixel.
+#   "brightness": pixel brightness, through fixed thresholds.
+#   "auto": "index" for images with a palette, otherwise "brightness".
+# rect: (x, y, w, h) in tiles; only tiles in this rectangle of the sheet are set.
+def set_chr_rom_from_image(data, img, mode="auto", rect=None):
+    if mode == "auto":
+        mode = "index" if img.mode == "P" else "brightness"
+    if mode not in chr_import_modes:
+        data.errors += ["Unknown chr import mode \"" + mode + "\"; must be one of " + ", ".join(chr_import_modes)]
+        return False
+    if mode == "index":
+        if img.mode != "P":
+            data.errors += ["Importing chr by palette index requires an image with a palette."]
+            return False
+    else:
+        img = img.convert("RGB")
+    
+    tiles = chr_sheet_tiles(rect)
+    colours = [[constants.palette_rgb[c] for c in palette] for palette in chr_sheet_palettes]
+    
+    if chrstore.available:
+        # pixels outside the image are taken as 0 (black).
+        pixs = numpy.asarray(img, dtype=numpy.int32)
+        sheet = numpy.zeros((0x80, 0x100) + pixs.shape[2:], dtype=numpy.int32)
+        h, w = min(0x80, pixs.shape[0]), min(0x100, pixs.shape[1])
+        sheet[:h, :w] = pixs[:h, :w]
+        
+        # (tile y, y, page, tile x, x) -> (page, tile, y, x)
+        sheet = sheet.reshape((0x10, 8, 2, 0x10, 8) + sheet.shape[2:])
+        sheet = sheet.transpose((2, 0, 3, 1, 4) + tuple(range(5, sheet.ndim)))
+        sheet = sheet.reshape((2, 0x100, 8, 8) + sheet.shape[5:])
+        
+        if mode == "index":
+            arr = sheet
+        elif mode == "brightness":
+            v = sheet.sum(axis=-1) / float(0x300)
+            arr = (v >= 0.1).astype(numpy.int32) + (v >= 0.24) + (v >= 0.7)
+        else:
+            arr = numpy.stack([
+                ((sheet[b][..., None, :] - numpy.array(colours[b])) ** 2).sum(axis=-1).argmin(axis=-1)
+                for b in range(2)
+            ])
+        
+        if len(tiles) == 0:
+            return True
+        pages, imgs = numpy.array(tiles).T
+        arr = arr[pages, imgs]
+        if mode == "index" and (arr > 3).any():
+            data.errors += ["Chr image uses palette indices above 3."]
+            return False
+        
+        # apply to rom data.
+        chr = chrstore.from_lists(data.chr)
+        chr[pages, imgs] = arr
+        data.chr = chr
+        return True
+    
     pixs = list(img.getdata())
-    for b in range(2):
-        for ya in range(0x10):
-            for xa in range(0x10):
-                # chr image tile data to array
-                arr = [[0 for x in range(8)] for y in range(8)]
-                for y in range(0x8):
-                    for x in range(0x8):
-                        i = b * 0x80 + x + 0x100 * y + 0x800 * ya + 0x8 * xa
-                        if i >= len(pixs):
-                            continue
-                        pix = pixs[i]
-                        v = float(pix[0] + pix[1] + pix[2]) / float(0x300)
-
-                        # convert intensity to a 0-4 value, through a highly bespoke and stupid formula.
-                        pal = 3
-                        if v < 0.1:
-                            pal = 0
-                        elif v < 0.24:
-                            pal = 1
-                        elif v < 0.7:
-                            pal = 2
-                        
-                        arr[y][x] = pal
-                
-                # apply to rom data.
-                data.chr[b][ya * 0x10 + xa] = arr
+    result = []
+    for b, i in tiles:
+        # chr image tile data to array
+        arr = [[0 for x in range(8)] for y in range(8)]
+        for y in range(0x8):
+            for x in range(0x8):
+                px = b * 0x80 + (i % 0x10) * 0x8 + x
+                py = (i // 0x10) * 0x8 + y
+                if px >= img.width or py >= img.height:
+                    continue
+                pix = pixs[px + py * img.width]
+                if mode == "index":
+                    if pix > 3:
+                        data.errors += ["Chr image uses palette indices above 3."]
+                        return False
+                    arr[y][x] = pix
+                elif mode == "brightness":
+                    arr[y][x] = brightness_to_chr(pix)
+                else:
+                    arr[y][x] = nearest_to_chr(pix, colours[b])
+        result.append((b, i, arr))
+    
+    # apply to rom data.
+    for b, i, arr in result:
+        data.chr[b][i] = arr
     return True
 
-def produce_micro_tile_images(data, world, hard=False):
-    minitile_images = []
-    for palette_idx in range(4):
-        minitile_images_paletted = []
+# rendered images are cached here, keyed on everything that feeds them
+# (palettes and chr contents), so that e.g. each world's tiles are drawn once.
+render_cache = dict()
+render_cache_size = 64
+
+def cached_render(key, produce):
+    if key not in render_cache:
+        if len(render_cache) >= render_cache_size:
+            render_cache.clear()
+        render_cache[key] = produce()
+    return render_cache[key]
+
+# returns (palettes, hidden tile palettes) used to draw micro-tiles
+# world can be a World, a list of 4 palettes, or None (default palettes)
+def micro_tile_palettes(world, hard=False):
+    if type(world) is type([]):
+        return world[:4], []
+    elif world is None:
+        return constants.bg_palettes[:4], []
+    else:
+        return world.palettes[(4 if hard else 0):(8 if hard else 4)], world.hidden_tile_palettes()
+
+# returns an image of the 0x100 micro-tiles drawn in each of the 4 palettes;
+# micro-tile i in palette p is at (8 * i, 8 * p).
+def produce_micro_tile_atlas(data, world, hard=False):
+    palettes, hidden_palettes = micro_tile_palettes(world, hard)
+    tiles = data.chr[0]
+    key = (
+        "micro-tiles",
+        tuple(tuple(palette) if palette is not None else None for palette in palettes),
+        tuple(hidden_palettes),
+        chrstore.encode(tiles)
+    )
+    return cached_render(key, lambda: render_micro_tile_atlas(tiles, palettes, hidden_palettes))
+
+def render_micro_tile_atlas(tiles, palettes, hidden_palettes):
+    danger_colour = (0xff, 0x30, 0x38)
+    if chrstore.available:
+        tiles = numpy.asarray(tiles, dtype=numpy.uint8)
+        rgb = numpy.array(constants.palette_rgb, dtype=numpy.uint8)
+        ys, xs = numpy.indices((8, 8))
+        checker = (xs + ys) % 2 == 1
+        hidden = numpy.zeros((0x100, 8, 8), dtype=bool)
+        hidden[list(constants.hidden_micro_tiles)] = checker
+        dangerous = numpy.zeros((0x100, 8, 8), dtype=bool)
+        dangerous[list(constants.dangerous_micro_tiles)] = checker
+        
+        # (palette, y, tile, x, rgb)
+        atlas = numpy.zeros((4, 8, 0x100, 8, 3), dtype=numpy.uint8)
+        for palette_idx, palette in enumerate(palettes):
+            if palette is None:
+                continue
+            cols = rgb[numpy.array(palette)[tiles]]
+            
+            # hidden block effect
+            if palette_idx in hidden_palettes:
+                cols[hidden] = constants.hidden_colour
+            
+            # dangerous block effect
+            cols[dangerous] = danger_colour
+            atlas[palette_idx] = cols.transpose(1, 0, 2, 3)
+        return Image.fromarray(atlas.reshape(32, 0x800, 3), "RGB")
+    
+    img = Image.new('RGB', (0x800, 32), color = 'black')
+    for palette_idx, palette in enumerate(palettes):
+        if palette is None:
+            continue
         for i in range(0x100):
-            if type(world) is type([]):
-                palette = world[palette_idx]
-            else:
-                if world is None:
-                    palette = constants.bg_palettes[palette_idx]
-                else:
-                    palette = world.palettes[palette_idx + (4 if hard else 0)]
-            img = Image.new('RGB', (8, 8), color = 'black')
-            if palette is not None:
-                arr = data.chr[i // 0x100][i % 0x100]
-                for x in range(8):
-                    for y in range(8):
-                        col_idx = arr[y][x]
-                        rgb = constants.palette_rgb[palette[col_idx]]
-                        
-                        # hidden block effect
-                        if world is not None and type(world) is not type([]) and i in constants.hidden_micro_tiles and palette_idx in world.hidden_tile_palettes():
-                            if (x + y) % 2 == 1:
-                                rgb = constants.hidden_colour
-                        
-                        # dangerous block effect
-                        if i in constants.dangerous_micro_tiles:
-                            if (x + y) % 2 == 1:
-                                rgb = (0xff, 0x30, 0x38)
-                                
-                        img.putpixel((x, y), rgb)
-            minitile_images_paletted.append(img)
-        minitile_images.append(minitile_images_paletted)
-    return minitile_images
+            arr = tiles[i]
+            for x in range(8):
+                for y in range(8):
+                    col_idx = arr[y][x]
+                    rgb = constants.palette_rgb[palette[col_idx]]
+                    
+                    # hidden block effect
+                    if i in constants.hidden_micro_tiles and palette_idx in hidden_palettes:
+                        if (x + y) % 2 == 1:
+                            rgb = constants.hidden_colour
+                    
+                    # dangerous block effect
+                    if i in constants.dangerous_micro_tiles:
+                        if (x + y) % 2 == 1:
+                            rgb = danger_colour
+                            
+                    img.putpixel((i * 8 + x, palette_idx * 8 + y), rgb)
+    return img
+
+# returns [palette_idx][micro-tile idx] -> 8x8 image
+def produce_micro_tile_images(data, world, hard=False):
+    atlas = produce_micro_tile_atlas(data, world, hard)
+    return [
+        [atlas.crop((i * 8, palette_idx * 8, i * 8 + 8, palette_idx * 8 + 8)) for i in range(0x100)]
+        for palette_idx in range(4)
+    ]
 
 def produce_title_screen(data, k):
     img = Image.new('RGB', (256, 224), color = 'black')
@@ -165,30 +341,105 @@ def produce_title_screen(data, k):
         chr_to_img(data, tile // 0x100, tile % 0x100, img, palette, (x, y))
     return img
 
-def export_images(data, path=".", only=None):
-    if not os.path.exists(path):
-        os.path.makedirs(path)
-
-    # export chr
-    outfile = "mm-chr.png"
-    print("exporting", outfile)
-    outfile = os.path.join(path, outfile)
-    chr_image = produce_chr_sheet(data)
-    chr_image.save(outfile)
-
-    # export title
-    outfile = "mm-title.png"
-    print("exporting", outfile)
-    outfile = os.path.join(path, outfile)
-    produce_title_screen(data, 0).save(outfile)
+# returns [med-tile idx] -> (micro-tile idxs, palette idx), or None if the med-tile has no palette
+def med_tile_lookup(world, hard=False):
+    lookup = []
+    for medtile_idx in range(0x100):
+        palette_idx = world.get_med_tile_palette_idx(medtile_idx, hard)
+        if palette_idx is None:
+            lookup.append(None)
+            continue
+        medtile = world.get_med_tile(medtile_idx)
+        lookup.append(([world.get_micro_tile(medtile[i], hard) for i in range(4)], palette_idx % 4))
+    return lookup
+
+# renders the level's tiles (no objects). returns (image, dangerous), where
+# dangerous[y][x] marks micro-tiles which are dangerous (these are left undrawn).
+def render_level_tiles(data, level, hard=False):
+    atlas = produce_micro_tile_atlas(data, level.world, hard)
+    lookup = med_tile_lookup(level.world, hard)
+    tile_rows, macro_tile_idxs = level.produce_med_tiles(hard)
+    
+    w = 256
+    h = 32 * level.macro_row_count
     
-    # export ending
-    outfile = "mm-ending.png"
-    print("exporting", outfile)
-    outfile = os.path.join(path, outfile)
-    produce_title_screen(data, 1).save(outfile)
+    # atlas index (palette_idx * 0x100 + micro-tile idx) for each micro-tile in the image,
+    # or blank for none. rows are produced from the bottom up.
+    blank = 0x400
+    cells = [[blank for x in range(0x20)] for y in range(h // 8)]
+    dangerous = [[False for x in range(0x20)] for y in range(h // 8)]
+    for r, row in enumerate(tile_rows):
+        y = h // 8 - 2 * (r + 1)
+        if y < 0:
+            break
+        for c, medtile_idx in enumerate(row):
+            if lookup[medtile_idx] is None:
+                continue
+            microtile_idxs, palette_idx = lookup[medtile_idx]
+            for i in range(4):
+                _x = 2 * c + i % 2
+                _y = y + i // 2
+                if microtile_idxs[i] in constants.dangerous_micro_tiles:
+                    dangerous[_y][_x] = True
+                else:
+                    cells[_y][_x] = palette_idx * 0x100 + microtile_idxs[i]
+    
+    if chrstore.available:
+        # gather all micro-tiles from the atlas in one step.
+        tiles = numpy.asarray(atlas).reshape(4, 8, 0x100, 8, 3).transpose(0, 2, 1, 3, 4).reshape(0x400, 8, 8, 3)
+        tiles = numpy.concatenate((tiles, numpy.zeros((1, 8, 8, 3), dtype=numpy.uint8)))
+        pixels = tiles[numpy.array(cells, dtype=numpy.intp).reshape(h // 8, 0x20)]
+        img = Image.fromarray(pixels.transpose(0, 2, 1, 3, 4).reshape(h, w, 3), "RGB")
+    else:
+        img = Image.new('RGB', (w, h), color = 'black')
+        for y, row in enumerate(cells):
+            for x, cell in enumerate(row):
+                if cell != blank:
+                    img.paste(atlas.crop(((cell % 0x100) * 8, (cell // 0x100) * 8, (cell % 0x100) * 8 + 8, (cell // 0x100) * 8 + 8)), (x * 8, y * 8))
+    return img, dangerous
 
-    # export levels
+# draws the level's objects onto img, alpha-compositing their sprites.
+def draw_level_objects(data, level, img, dangerous, object_images):
+    draw = ImageDraw.Draw(img)
+    for obj in level.objects:
+        if obj.drop:
+            continue
+        x = obj.x * 8 - 4
+        y = obj.y * 8
+        text = hb(obj.gid)
+        objimg = object_images[obj.gid] if obj.gid < len(object_images) else None
+        
+        if obj.flipx and obj.flipy:
+            text += "+"
+        elif obj.flipx:
+            text += "-"
+        elif obj.flipy:
+            text += "|"
+        if objimg is None:
+            draw.text((x, y), text, fill="white" if data.get_object_name(obj.gid)[0:4] != "unk-" else "red")
+        else:
+            x += 4 - objimg.width//2 + objimg._mm_offset[0]
+            y += 8 - objimg.height + objimg._mm_offset[1]
+            is_dangerous = obj.y < len(dangerous) and obj.x < len(dangerous[obj.y]) and dangerous[obj.y][obj.x]
+            if not objimg._mm_hard or is_dangerous:
+                paste_image = objimg
+                if obj.flipx:
+                    paste_image = ImageOps.mirror(paste_image)
+                if obj.flipy:
+                    paste_image = ImageOps.flip(paste_image)
+                img.paste(paste_image, (x, y), paste_image)
+
+# renders the level (tiles and objects) as an RGB image.
+# object_images: from produce_object_images, or None to omit objects.
+def render_level(data, level, hard=False, object_images=None):
+    img, dangerous = render_level_tiles(data, level, hard)
+    if object_images is not None:
+        draw_level_objects(data, level, img, dangerous, object_images)
+    return img
+
+# returns [(file name, kind, level idx, hard)] for each image to export.
+def export_tasks(data):
+    tasks = [("mm-chr.png", "chr", None, False), ("mm-title.png", "title", 0, False), ("mm-ending.png", "title", 1, False)]
     for level in data.levels:
         for hard in [False, True]:
             outfile = "mm-" + str(level.world_idx + 1) + "-" + str(level.world_sublevel + 1) + ("h" if hard else "") + ".png"
@@ -196,76 +447,102 @@ def export_images(data, path=".", only=None):
                 if hard:
                     continue
                 outfile = "mm-finale.png"
-            print("exporting " + outfile + " ...")
-            outfile = os.path.join(path, outfile)
-            
-            # create tiles per-palette per-level (could be optimized to per-world)
-            minitile_images = produce_micro_tile_images(data, level.world, hard)
-            
-            # create object data images
-            object_images = produce_object_images(data)
-                
-            w = 256
-            h = 32 * level.macro_row_count
-            img = Image.new('RGB', (w, h), color = 'black')
-            draw = ImageDraw.Draw(img)
-            
-            tile_rows, macro_tile_idxs = level.produce_med_tiles(hard)
-            
-            y = h
-            
-            dangerous_tiles = [[False for y in range(level.macro_row_count * 4)] for x in range(0x20)]
-            
-            for row in tile_rows:
-                x = -16
-                y -= 16
-                for medtile_idx in row:
-                    x += 16
-                    offsets = [(0, 0), (8, 0), (0, 8), (8, 8)]
-                    medtile = level.world.get_med_tile(medtile_idx)
-                    palette_idx = level.world.get_med_tile_palette_idx(medtile_idx, hard) % 4
-                    if palette_idx is None:
-                        continue
-                    # draw subtiles
-                    for i in range(4):
-                        microtile_idx = level.world.get_micro_tile(medtile[i], hard)
-                        
-                        offx = offsets[i][0]
-                        offy = offsets[i][1]
-                        _x = x + offx
-                        _y = y + offy
-                        
-                        if (microtile_idx in constants.dangerous_micro_tiles):
-                            dangerous_tiles[_x // 8][_y // 8] = True
-                        else:
-                            img.paste(minitile_images[palette_idx][microtile_idx], (_x, _y))
-                    
-            # objects
-            for obj in level.objects:
-                if obj.drop:
-                    continue
-                x = obj.x * 8 - 4
-                y = obj.y * 8
-                text = hb(obj.gid)
-                objimg = object_images[obj.gid] if obj.gid < len(object_images) else None
-                
-                if obj.flipx and obj.flipy:
-                    text += "+"
-                elif obj.flipx:
-                    text += "-"
-                elif obj.flipy:
-                    text += "|"
-                if objimg is None:
-                    draw.text((x, y), text, fill="white" if data.get_object_name(obj.gid)[0:4] != "unk-" else "red")
-                else:
-                    x += 4 - objimg.width//2 + objimg._mm_offset[0]
-                    y += 8 - objimg.height + objimg._mm_offset[1]
-                    if not objimg._mm_hard or dangerous_tiles[obj.x][obj.y]:
-                        paste_image = objimg
-                        if obj.flipx:
-                            paste_image = ImageOps.mirror(paste_image)
-                        if obj.flipy:
-                            paste_image = ImageOps.flip(paste_image)
-                        img.paste(paste_image, (x, y))
+            tasks.append((outfile, "level", level.level_idx, hard))
+    return tasks
+
+def export_task(data, path, task):
+    outfile, kind, idx, hard = task
+    if kind == "chr":
+        img = produce_chr_sheet(data)
+    elif kind == "title":
+        img = produce_title_screen(data, idx)
+    else:
+        img = render_level(data, data.levels[idx], hard, produce_object_images(data))
+    img.save(os.path.join(path, outfile))
+    return outfile
+
+# model snapshot used by export worker processes
+export_data = None
+
+def init_export_worker(snapshot):
+    global export_data
+    export_data = pickle.loads(snapshot)
+
+def export_worker_task(args):
+    return export_task(export_data, *args)
+
+# increment whenever rendering changes, so that existing exports are redone.
+export_format = 1
+
+# records the input hash of each exported image, in the export directory.
+export_manifest_name = "mm-export-manifest.json"
+
+# returns a hash of everything that feeds the given export task's image.
+def export_task_hash(data, task, chr_bytes):
+    outfile, kind, idx, hard = task
+    if kind == "chr":
+        inputs = chr_sheet_palettes
+    elif kind == "title":
+        inputs = (data.title_screen.table[idx], data.title_screen.palette_idxs[idx], data.title_screen.palettes[idx])
+    else:
+        level = data.levels[idx]
+        inputs = (
+            level.macro_row_count,
+            level.produce_med_tiles(hard)[0],
+            med_tile_lookup(level.world, hard),
+            micro_tile_palettes(level.world, hard),
+            [(obj.gid, obj.x, obj.y, obj.flipx, obj.flipy, obj.drop, data.get_object_name(obj.gid)[0:4]) for obj in level.objects],
+            data.sprite_palettes
+        )
+    return hashlib.sha1(repr((export_format, kind, idx, hard, inputs)).encode("utf-8") + chr_bytes).hexdigest()
+
+def read_export_manifest(path):
+    try:
+        with open(os.path.join(path, export_manifest_name), "r") as f:
+            manifest = json.load(f)
+            if type(manifest) is dict:
+                return manifest
+    except (OSError, ValueError):
+        pass
+    return dict()
+
+# only: if given, the file names of the images to export (see export_tasks); others are skipped.
+# jobs: number of processes to render with.
+# force: export all images, even those which are unchanged according to the manifest.
+def export_images(data, path=".", only=None, jobs=1, force=False):
+    if not os.path.exists(path):
+        os.makedirs(path)
+    
+    # skip images whose inputs have not changed since they were last exported here.
+    manifest = read_export_manifest(path)
+    chr_bytes = chrstore.encode(data.chr)
+    hashes = dict()
+    tasks = []
+    for task in export_tasks(data):
+        if only is not None and task[0] not in only:
+            # not exported, so the manifest entry for the existing file (if any) still holds.
+            if task[0] in manifest:
+                hashes[task[0]] = manifest[task[0]]
+            continue
+        hashes[task[0]] = export_task_hash(data, task, chr_bytes)
+        if not force and manifest.get(task[0]) == hashes[task[0]] and os.path.exists(os.path.join(path, task[0])):
+            print("unchanged", task[0])
+        else:
+            tasks.append(task)
             
-            img.save(outfile)
\ No newline at end of file
+    if jobs > 1 and len(tasks) > 1:
+        # workers render from a pickled snapshot of the model,
+        # so later changes to data do not affect the export.
+        # (multiprocessing.Pool, as ProcessPoolExecutor only takes an initializer from python 3.7)
+        snapshot = pickle.dumps(data)
+        with multiprocessing.Pool(min(jobs, len(tasks)), init_export_worker, (snapshot,)) as pool:
+            for outfile in pool.imap(export_worker_task, [(path, task) for task in tasks]):
+                print("exported", outfile)
+    else:
+        for task in tasks:
+            print("exporting", task[0])
+            export_task(data, path, task)
+    
+    with open(os.path.join(path, export_manifest_name), "w") as f:
+        json.dump(hashes, f, indent=1, sort_keys=True)
+    return True
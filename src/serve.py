@@ -0,0 +1,182 @@
+import concurrent.futures
+import hashlib
+import http.server
+import json
+import os
+import socketserver
+import tempfile
+import urllib.parse
+from src import batch
+from src import constants
+
+# local build server: holds the decoded base rom in memory and builds hacks on request,
+# so that callers pay neither process startup nor the base rom decode.
+#
+# GET /
+#   returns json describing the server (editor version, base rom md5, outputs).
+#
+# POST /build?output=<output>[&select=.path][&level=n][&hard=1]
+#   body: a hack.txt file, or json to apply (if the content type is application/json),
+#         of at most max_request_size bytes (413 if larger, 411 without a Content-Length.)
+#   output: nes, ips, bps, txt (hack.txt), json (optionally restricted by select),
+#           or png (the stage with index level, or the chr sheet if no level is given.)
+#   responds 200 with the output, or 400 with the errors (one per line) if the request
+#   is invalid or the hack cannot be built. warnings are listed in the
+#   X-MMagEdit-Warnings header (as a json list). unexpected failures respond 500.
+#
+# only listens on localhost.
+
+default_port = 8037
+
+# largest request body accepted, in bytes.
+max_request_size = 1 << 20
+
+# output: (file name, content type)
+outputs = {
+    "nes": ("out.nes", "application/octet-stream"),
+    "ips": ("out.ips", "application/octet-stream"),
+    "bps": ("out.bps", "application/octet-stream"),
+    "txt": ("out.txt", "text/plain; charset=utf-8"),
+    "json": ("out.json", "application/json"),
+    "png": ("out.png", "image/png"),
+}
+
+# (http.server.ThreadingHTTPServer requires python 3.7)
+class BuildServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+    # jobs: number of processes to build with (each holding its own copy of base.)
+    def __init__(self, address, base, jobs=1):
+        super().__init__(address, BuildRequestHandler)
+
+        # commit the base once, so that each clone only re-encodes what its hack changes.
+        base.build()
+        self.base = base
+        self.info = {
+            "editor": constants.mmname,
+            "format": constants.mmfmt,
+            "rom-md5": hashlib.md5(base.orgbin).hexdigest(),
+            "outputs": list(outputs),
+        }
+
+        if jobs > 1:
+            # each worker unpickles the base model once, then clones it per request.
+            self.processes = batch.worker_pool(base, jobs)
+            self.pool = None
+        else:
+            # requests are still accepted concurrently, but built one at a time.
+            self.processes = None
+            self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+    # builds the given batch entry (see src/batch.py) on a clone of the base.
+    # returns (success, errors, seconds taken, crashed).
+    def build(self, entry):
+        if self.processes is not None:
+            return self.processes.apply(batch.batch_worker_task, (entry,))
+        return self.pool.submit(batch.timed_build_entry, self.base, entry).result()
+
+    def server_close(self):
+        super().server_close()
+        if self.processes is not None:
+            self.processes.terminate()
+        else:
+            self.pool.shutdown()
+
+class BuildRequestHandler(http.server.BaseHTTPRequestHandler):
+    def respond(self, code, body, content_type="text/plain; charset=utf-8", warnings=[]):
+        if type(body) == str:
+            body = body.encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        if len(warnings) > 0:
+            self.send_header("X-MMagEdit-Warnings", json.dumps(warnings))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if urllib.parse.urlparse(self.path).path != "/":
+            self.respond(404, "not found\n")
+            return
+        self.respond(200, json.dumps(self.server.info), "application/json")
+
+    def do_POST(self):
+        url = urllib.parse.urlparse(self.path)
+        if url.path != "/build":
+            self.respond(404, "not found\n")
+            return
+        query = {key: values[-1] for key, values in urllib.parse.parse_qs(url.query).items()}
+        output = query.get("output", "nes")
+        if output not in outputs:
+            self.respond(400, "output must be one of: " + ", ".join(outputs) + "\n")
+            return
+
+        try:
+            length = int(self.headers.get("Content-Length", ""))
+        except ValueError:
+            length = -1
+        if length < 0:
+            self.respond(411, "a valid Content-Length is required\n")
+            return
+        if length > max_request_size:
+            self.respond(413, "request body must be at most " + str(max_request_size) + " bytes\n")
+            return
+        try:
+            body = self.rfile.read(length).decode("utf-8")
+        except ValueError:
+            self.respond(400, "request body must be utf-8 text\n")
+            return
+        if body.strip() == "":
+            self.respond(400, "request body must be a hack.txt file or json\n")
+            return
+
+        with tempfile.TemporaryDirectory() as folder:
+            outfile, content_type = outputs[output]
+            entry = {output: os.path.join(folder, outfile)}
+            if output == "json" and "select" in query:
+                entry["select"] = query["select"]
+            if output == "png" and "level" in query:
+                try:
+                    entry["level"] = int(query["level"])
+                except ValueError:
+                    entry["level"] = -1
+                if entry["level"] not in range(len(self.server.base.levels)):
+                    self.respond(400, "level must be from 0 to " + str(len(self.server.base.levels) - 1) + "\n")
+                    return
+                entry["hard"] = query.get("hard", "0") not in ["", "0", "false"]
+            if self.headers.get("Content-Type", "").startswith("application/json"):
+                try:
+                    entry["apply"] = json.loads(body)
+                except ValueError:
+                    self.respond(400, "request body is not valid json\n")
+                    return
+            else:
+                entry["hack"] = os.path.join(folder, "in.txt")
+                with open(entry["hack"], "w") as f:
+                    f.write(body)
+
+            result, errors, t, crashed = self.server.build(entry)
+            if crashed:
+                # details stay in the server's log.
+                self.log_error("build failed: %s", "; ".join(errors))
+                self.respond(500, "internal error\n")
+                return
+            if not result:
+                self.respond(400, "".join(error + "\n" for error in errors))
+                return
+            with open(entry[output], "rb") as f:
+                self.respond(200, f.read(), content_type, errors)
+
+# serves until interrupted.
+def serve(base, port=None, jobs=1):
+    if port is None:
+        port = default_port
+    server = BuildServer(("127.0.0.1", port), base, jobs)
+    print("Serving builds of " + server.info["rom-md5"] + " on http://127.0.0.1:" + str(server.server_address[1]) + "/", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return True